@@ -1,11 +1,16 @@
 from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
 
-from . import router_auth_api, router_recipes_api
+from . import (router_auth_api, router_export_api, router_internal_api,
+               router_recipes_api)
 
 router = APIRouter(
     prefix='/api',
     tags=['api'],
+    default_response_class=ORJSONResponse,
 )
 
 router.include_router(router_auth_api.router)
 router.include_router(router_recipes_api.router)
+router.include_router(router_internal_api.router)
+router.include_router(router_export_api.router)
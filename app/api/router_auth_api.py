@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import (APIRouter, Depends, HTTPException, Request, Response,
+                     status)
 
 import dao
 from app.auth import dependencies
 from app.auth.auth_lib import AuthHandler, AuthLibrary
+from database import get_session
 
 from .schemas import AuthDetails, AuthLogin, AuthRegistered
 
@@ -13,45 +15,47 @@ router = APIRouter(
 
 
 @router.post('/register', response_model=AuthRegistered, status_code=status.HTTP_201_CREATED)
-async def register_api(response: Response, auth_details: AuthDetails):
-    is_login_already_used = await dao.get_user_by_login(auth_details.login)
+async def register_api(response: Response, auth_details: AuthDetails, session=Depends(get_session)):
+    # hashed before the lookups, so the request session holds no connection while it runs
+    hashed_password = await AuthHandler.get_password_hash(auth_details.password)
+
+    is_login_already_used = await dao.get_user_by_login(auth_details.login, session=session)
     if is_login_already_used:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail=f'User with email {auth_details.login} already exists'
         )
 
-    hashed_password = await AuthHandler.get_password_hash(auth_details.password)
-
     user_data = await dao.create_user(
         name=auth_details.name,
         login=auth_details.login,
         password=hashed_password,
         notes=auth_details.notes,
+        session=session
     )
 
-    token = await AuthHandler.encode_token(user_data[0])
+    await AuthHandler.login(response, user_data[0], session=session)
     response.set_cookie(key='my_name', value='Vasyl', max_age=1000, httponly=True)
-    response.set_cookie(key='token', value=token, httponly=True)
 
     return AuthRegistered(success=True, id=user_data[0], login=user_data[1])
 
 
 @router.get('/delete-my-account')
-async def delete_my_account_api(user=Depends(dependencies.get_current_user_required)):
-    await dao.delete_user(user.id)
+async def delete_my_account_api(session=Depends(get_session), user=Depends(dependencies.get_current_user_required)):
+    await dao.delete_user(user.id, session=session)
     return {"account_deleted": True}
 
 
 @router.post('/login')
-async def login_api(response: Response, user_data: AuthLogin):
-    user = await AuthLibrary.authenticate_user(user_data.login, user_data.password)
-    token = await AuthHandler.encode_token(user.id)
-    response.set_cookie(key='token', value=token, httponly=True, max_age=1000)
+async def login_api(response: Response, user_data: AuthLogin, session=Depends(get_session)):
+    user = await AuthLibrary.authenticate_user(user_data.login, user_data.password, session=session)
+    await AuthHandler.login(response, user.id, session=session)
     return {'user': user.login, "logged_in": True}
 
 
 @router.get('/logout')
-async def logout_api(response: Response):
-    response.delete_cookie('token')
+async def logout_api(request: Request, response: Response, session=Depends(get_session)):
+    if refresh_token := request.cookies.get('refresh_token'):
+        await AuthHandler.revoke_refresh_token(refresh_token, session=session)
+    AuthHandler.delete_auth_cookies(response)
     return {"logged_out": True}
@@ -0,0 +1,83 @@
+import csv
+import datetime
+import io
+import json
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+
+import dao
+from app.auth import dependencies
+
+router = APIRouter(
+    prefix='/export',
+    tags=['export'],
+    dependencies=[Depends(dependencies.get_current_superuser)],
+)
+
+RECIPE_FIELDS = ['id', 'name', 'description', 'recipe', 'image', 'categories', 'creator_id', 'popularity', 'created_at']
+USER_FIELDS = ['id', 'name', 'login', 'email', 'is_superuser', 'notes', 'created_at']
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+async def _ndjson_lines(rows, fields: list):
+    async for row in rows:
+        yield json.dumps({key: row[key] for key in fields}, default=_json_default, ensure_ascii=False) + '\n'
+
+
+async def _csv_lines(rows, fields: list):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    # the header goes out even when no row matches
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    async for row in rows:
+        # same category notation as the CSV recipe import
+        writer.writerow([
+            ';'.join(map(str, row[key] or [])) if key == 'categories' else row[key]
+            for key in fields
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _export_response(rows, fields: list, format: str, filename: str):
+    lines = _csv_lines(rows, fields) if format == 'csv' else _ndjson_lines(rows, fields)
+    return StreamingResponse(
+        lines,
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{format}"'}
+    )
+
+
+@router.get('/recipes')
+async def export_recipes(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    categories: List[int] = Query([]),
+    creator_id: int | None = Query(None),
+    after_id: int = Query(0)
+):
+    rows = dao.stream_recipes(categories=categories, creator_id=creator_id, after_id=after_id)
+    return _export_response(rows, RECIPE_FIELDS, format, 'recipes')
+
+
+@router.get('/users')
+async def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    after_id: int = Query(0)
+):
+    return _export_response(dao.stream_users(after_id=after_id), USER_FIELDS, format, 'users')
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends
+
+import database
+from app.auth import dependencies
+from app.auth.auth_lib import AuthHandler
+
+router = APIRouter(
+    prefix='/internal',
+    tags=['internal'],
+    dependencies=[Depends(dependencies.get_current_superuser)],
+)
+
+
+@router.get('/pool')
+async def pool():
+    return {
+        'primary': database.pool_status(database.engine),
+        'replicas': [database.pool_status(replica_engine) for replica_engine in database.replica_engines],
+    }
+
+
+@router.get('/password-hashing')
+async def password_hashing():
+    return AuthHandler.hasher.status()
@@ -1,13 +1,16 @@
-import re
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import (APIRouter, Depends, HTTPException, Query, Request,
+                     Response, UploadFile, status)
 
 import dao
-import settings
+import recipe_import
+from app import http_cache
 from app.auth import dependencies
+from database import get_session
+from view_counter import view_counter
 
-from .schemas import Recipe
+from .schemas import ImportReport, ImportRowError, Recipe, RecipeList
 
 router = APIRouter(
     prefix='/recipes',
@@ -16,8 +19,8 @@ router = APIRouter(
 
 
 @router.get('/delete-recipe/{recipe_id}')
-async def delete_recipe(recipe_id: int, user=Depends(dependencies.get_current_user_required)):
-    if not (recipe_object := await dao.get_recipe_by_id(recipe_id)):
+async def delete_recipe(recipe_id: int, session=Depends(get_session), user=Depends(dependencies.get_current_user_required)):
+    if not (recipe_object := await dao.get_recipe_by_id(recipe_id, session=session)):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Recipe #{recipe_id} does not exist.'
@@ -29,11 +32,11 @@ async def delete_recipe(recipe_id: int, user=Depends(dependencies.get_current_us
             detail="You don't have permission to delete this recipe."
             )
 
-    await dao.delete_recipe(recipe_id)
+    await dao.delete_recipe(recipe_id, session=session)
     return {"success": True}
 
 
-@router.post('/update-recipe')
+@router.post('/update-recipe', response_model=Recipe)
 async def update_recipe(
     recipe_id: int,
     name: str,
@@ -41,10 +44,11 @@ async def update_recipe(
     recipe: str,
     categories: List[int] = Query([]),
     image: str = "",
+    session=Depends(get_session),
     user=Depends(dependencies.get_current_user_required)
 ):
 
-    if not (recipe_object := await dao.get_recipe_by_id(recipe_id)):
+    if not (recipe_object := await dao.get_recipe_by_id(recipe_id, session=session)):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Recipe #{recipe_id} does not exist.'
@@ -56,7 +60,7 @@ async def update_recipe(
             detail="You don't have permission to delete this recipe."
             )
 
-    if (recipe_exists := (await dao.get_recipe_by_name(name))) and recipe_exists.id != recipe_id:
+    if (recipe_exists := (await dao.get_recipe_by_name(name, session=session))) and recipe_exists.id != recipe_id:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=f'Recipe {name} already exists.')
 
     await dao.update_recipe(
@@ -65,10 +69,11 @@ async def update_recipe(
         image=image,
         recipe=recipe,
         categories=categories,
-        recipe_id=recipe_id
+        recipe_id=recipe_id,
+        session=session
         )
 
-    return Recipe(name=name, description=description, recipe=recipe, image=image, categories=categories)
+    return Recipe(id=recipe_id, name=name, description=description, recipe=recipe, image=image, categories=categories)
 
 
 @router.post('/create-recipe', response_model=Recipe, status_code=status.HTTP_201_CREATED)
@@ -78,166 +83,162 @@ async def create_recipe(
     recipe: str,
     categories: List[int] = Query([]),
     image: str = "",
+    session=Depends(get_session),
     user=Depends(dependencies.get_current_user_required)
 ):
-    if await dao.get_recipe_by_name(name):
+    if await dao.get_recipe_by_name(name, session=session):
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail=f'Recipe {name} already exists.'
             )
 
-    await dao.create_recipe(
+    created = await dao.create_recipe(
         name=name,
         description=description,
         image=image,
         recipe=recipe,
         categories=categories,
-        creator_id=user.id
+        creator_id=user.id,
+        session=session
         )
 
-    return Recipe(name=name, description=description, recipe=recipe, image=image, categories=categories)
+    return Recipe(id=created.id, name=name, description=description, recipe=recipe, image=image, categories=categories)
 
 
-@router.get('/recipe/{recipe_id}')
-async def recipe(recipe_id: int):
-    recipe = await dao.get_recipe_by_id(recipe_id)
+@router.post('/import', response_model=ImportReport)
+async def import_recipes(
+    file: UploadFile,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    session=Depends(get_session),
+    user=Depends(dependencies.get_current_superuser)
+):
+    report = await recipe_import.import_recipes(file.file, format, creator_id=user.id, session=session)
+
+    return ImportReport(
+        imported=report.imported,
+        errors=[ImportRowError(line=line, error=error) for line, error in report.errors]
+        )
+
+
+@router.get('/recipe/{recipe_id}', response_model=Recipe)
+async def recipe(recipe_id: int, request: Request, response: Response, session=Depends(get_session)):
+    version = await dao.get_recipe_version(recipe_id, session=session)
+    if version:
+        etag = http_cache.make_etag('recipe', recipe_id, version.version)
+        if http_cache.is_not_modified(request, etag, version.updated_at):
+            view_counter.record(recipe_id)
+            return http_cache.not_modified(etag, version.updated_at)
+
+    recipe = await dao.get_recipe_by_id(recipe_id, session=session)
     if not recipe:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Recipe #{recipe_id} does not exist.'
             )
 
-    await dao.increase_recipe_popularity(recipe_id)
+    view_counter.record(recipe_id)
+    response.headers.update(http_cache.validator_headers(
+        http_cache.make_etag('recipe', recipe.id, recipe.version),
+        recipe.updated_at
+        ))
+
+    return recipe
 
-    return Recipe(
-        name=recipe.name,
-        description=recipe.description,
-        recipe=recipe.recipe,
-        image=recipe.image,
-        categories=recipe.categories
-        )
 
+async def fetch_menu_page(**kwargs):
+    try:
+        return await dao.fetch_menu(**kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-@router.get('/menu')
-@router.post('/menu')
+
+@router.get('/menu', response_model=list[Recipe])
+@router.post('/menu', response_model=list[Recipe])
 async def get_menu(
+        request: Request,
         sort: str = Query(""),
         dish_name: str = Query(""),
         categories: List[int] = Query([]),
-        page: int = 0
+        page: int = 0,
+        after: str | None = Query(None),
+        session=Depends(get_session)
 ):
+    catalog = await dao.get_catalog_version(session=session)
+    etag = http_cache.make_etag('menu', catalog.version, sort, dish_name, sorted(categories), page, after)
+    if http_cache.is_not_modified(request, etag, catalog.updated_at):
+        return http_cache.not_modified(etag, catalog.updated_at)
+
+    async def render():
+        menu_page = await fetch_menu_page(
+            sort=sort,
+            dish_name=dish_name,
+            categories=categories,
+            page=page,
+            after=after,
+            session=session
+            )
+        recipes = RecipeList.validate_python([recipe[0] for recipe in menu_page.recipes], from_attributes=True)
+        response = Response(content=RecipeList.dump_json(recipes), media_type='application/json')
+        if menu_page.next_cursor:
+            response.headers['X-Next-Cursor'] = menu_page.next_cursor
+        return http_cache.to_cached(response)
+
+    entry = await http_cache.response_cache.get_or_render(
+        ('menu.json', sort, dish_name, tuple(sorted(categories)), page, after),
+        catalog.version,
+        render
+        )
+    return http_cache.from_cached(entry, http_cache.validator_headers(etag, catalog.updated_at))
 
-    recipes = []
-    skip = page * settings.Settings.NUM_RECIPES_ON_PAGE
-    all_fetched_recipes = await dao.fetch_recipes()
-
-    if categories:
-        filtered_recipes = list(filter(
-            lambda x: set(x[0].categories).issubset(set(categories)),
-            all_fetched_recipes))
-    else:
-        filtered_recipes = all_fetched_recipes
-
-    if re.sub(r"\s+", '', dish_name):
-        for dish in filtered_recipes:
-            if dish_name.lower() in dish[0].name.lower():
-                recipes.append(dish)
-    else:
-        recipes = filtered_recipes
-
-    if sort == "popularity-asc":
-        recipes = sorted(recipes, key=lambda x: x[0].popularity)
-    elif sort == "popularity-desc":
-        recipes = sorted(recipes, key=lambda x: x[0].popularity, reverse=True)
-    elif sort == "a-z":
-        recipes = sorted(recipes, key=lambda x: x[0].name.lower())
-    elif sort == "z-a":
-        recipes = sorted(recipes, key=lambda x: x[0].name.lower(), reverse=True)
-
-    recipes = recipes[skip:skip + settings.Settings.NUM_RECIPES_ON_PAGE]
-
-    return [Recipe(
-            id=recipe[0].id,
-            name=recipe[0].name,
-            description=recipe[0].description,
-            recipe=recipe[0].recipe,
-            image=recipe[0].image,
-            categories=recipe[0].categories,
-            popularity=recipe[0].popularity
-            ) for recipe in recipes]
-
-
-@router.get('/saved-recipes/')
-@router.post('/saved-recipes/')
+
+@router.get('/saved-recipes/', response_model=list[Recipe])
+@router.post('/saved-recipes/', response_model=list[Recipe])
 async def saved_recipes(
+        response: Response,
         sort: str = Query(""),
         dish_name: str = Query(""),
         categories: List[int] = Query([]),
         page: int = 0,
+        after: str | None = Query(None),
+        session=Depends(get_session),
         user=Depends(dependencies.get_current_user_required)
 ):
+    menu_page = await fetch_menu_page(
+        sort=sort,
+        dish_name=dish_name,
+        categories=categories,
+        page=page,
+        saver_id=user.id,
+        after=after,
+        session=session
+        )
+    if menu_page.next_cursor:
+        response.headers['X-Next-Cursor'] = menu_page.next_cursor
 
-    skip = page * 10
-    all_fetched_recipes = await dao.fetch_saved_recipes(user.id)
-
-    recipes = []
-    if categories:
-        filtered_recipes = list(filter(
-            lambda x: x[0].categories and set(x[0].categories).issubset(set(categories)),
-            all_fetched_recipes))
-    else:
-        filtered_recipes = all_fetched_recipes
-
-    if re.sub(r"\s+", '', dish_name):
-        for dish in filtered_recipes:
-            if dish_name.lower() in dish[0].name.lower():
-                recipes.append(dish)
-    else:
-        recipes = filtered_recipes
-
-    if sort == "popularity-asc":
-        recipes = sorted(recipes, key=lambda x: x[0].popularity)
-    elif sort == "popularity-desc":
-        recipes = sorted(recipes, key=lambda x: x[0].popularity, reverse=True)
-    elif sort == "a-z":
-        recipes = sorted(recipes, key=lambda x: x[0].name.lower())
-    elif sort == "z-a":
-        recipes = sorted(recipes, key=lambda x: x[0].name.lower(), reverse=True)
-
-    recipes = recipes[skip:skip + settings.Settings.NUM_RECIPES_ON_PAGE]
-
-    return [Recipe(
-            id=recipe[0].id,
-            name=recipe[0].name,
-            description=recipe[0].description,
-            recipe=recipe[0].recipe,
-            image=recipe[0].image,
-            categories=recipe[0].categories,
-            popularity=recipe[0].popularity
-            ) for recipe in recipes]
+    return [recipe[0] for recipe in menu_page.recipes]
 
 
 @router.get('/save-recipe/{recipe_id}')
-async def save_recipe(recipe_id: int, user=Depends(dependencies.get_current_user_required)):
-    if not await dao.get_recipe_by_id(recipe_id):
+async def save_recipe(recipe_id: int, session=Depends(get_session), user=Depends(dependencies.get_current_user_required)):
+    if not await dao.get_recipe_by_id(recipe_id, session=session):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Recipe #{recipe_id} does not exist.'
             )
 
-    await dao.save_recipe(recipe_id, user.id)
+    await dao.save_recipe(recipe_id, user.id, session=session)
 
     return {"saved": True}
 
 
 @router.get('/unsave-recipe/{recipe_id}')
-async def unsave_recipe(recipe_id: int, user=Depends(dependencies.get_current_user_required)):
-    if not await dao.get_recipe_by_id(recipe_id):
+async def unsave_recipe(recipe_id: int, session=Depends(get_session), user=Depends(dependencies.get_current_user_required)):
+    if not await dao.get_recipe_by_id(recipe_id, session=session):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Recipe #{recipe_id} does not exist.'
             )
 
-    await dao.unsave_recipe(recipe_id, user.id)
+    await dao.unsave_recipe(recipe_id, user.id, session=session)
 
     return {"unsaved": True}
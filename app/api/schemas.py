@@ -1,6 +1,6 @@
 from typing import List
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, TypeAdapter
 
 import settings
 
@@ -25,6 +25,8 @@ class AuthLogin(BaseModel):
 
 
 class Recipe(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int = Field()
     name: str = Field(examples=['Yakiniku'])
     description: str = Field(examples=['A very tasty food!'])
@@ -32,3 +34,16 @@ class Recipe(BaseModel):
     image: str = Field(default="", examples=['https://'])
     categories: List[int] = Field(default=[])
     popularity: int = Field(default=0)
+
+
+RecipeList = TypeAdapter(List[Recipe])
+
+
+class ImportRowError(BaseModel):
+    line: int = Field(examples=[12])
+    error: str = Field(examples=['Recipe Yakiniku already exists.'])
+
+
+class ImportReport(BaseModel):
+    imported: int = Field(examples=[99988])
+    errors: List[ImportRowError] = Field(default=[])
@@ -1,31 +1,103 @@
+import asyncio
+import hashlib
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 import jwt
-from fastapi import HTTPException, status
+from fastapi import HTTPException, Response, status
 from passlib.context import CryptContext
 from pydantic import EmailStr
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import dao
 import settings
 
 
+@dataclass
+class HashStats:
+    completed: int = 0
+    rejected: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+
+
+class PasswordHasher:
+    # bcrypt releases the GIL, so a small thread pool keeps it off the event loop
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = HashStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+
+    async def run(self, function, *args):
+        if self.pending >= self.max_pending:
+            self.stats.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Too many logins in progress, please try again',
+                headers={'Retry-After': '1'}
+            )
+
+        def timed():
+            started = time.perf_counter()
+            return started, function(*args), time.perf_counter()
+
+        self.pending += 1
+        queued_at = time.perf_counter()
+        try:
+            started, result, finished = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.pending -= 1
+
+        wait, duration = started - queued_at, finished - started
+        self.stats.completed += 1
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        self.stats.total_duration += duration
+        self.stats.max_duration = max(self.stats.max_duration, duration)
+        return result
+
+    def status(self) -> dict:
+        completed = self.stats.completed
+        return {
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'completed': completed,
+            'rejected': self.stats.rejected,
+            'avg_wait_ms': self.stats.total_wait / completed * 1000 if completed else 0.0,
+            'max_wait_ms': self.stats.max_wait * 1000,
+            'avg_duration_ms': self.stats.total_duration / completed * 1000 if completed else 0.0,
+            'max_duration_ms': self.stats.max_duration * 1000,
+        }
+
+
 class AuthHandler:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    hasher = PasswordHasher(
+        max_workers=settings.Settings.PASSWORD_HASH_WORKERS,
+        max_pending=settings.Settings.PASSWORD_HASH_MAX_PENDING
+    )
     secret = settings.Settings.TOKEN_SECRET
     algorithm = settings.Settings.TOKEN_ALGORITHM
 
     @classmethod
     async def get_password_hash(cls, password: str) -> str:
-        return cls.pwd_context.hash(password)
+        return await cls.hasher.run(cls.pwd_context.hash, password)
 
     @classmethod
     async def verify_password(cls, plain_password: str, hashed_password: str) -> bool:
-        return cls.pwd_context.verify(plain_password, hashed_password)
+        return await cls.hasher.run(cls.pwd_context.verify, plain_password, hashed_password)
 
     @classmethod
     async def encode_token(cls, user_id: int) -> str:
         payload = {
-            'exp': datetime.utcnow() + timedelta(days=0, minutes=5),
+            'exp': datetime.utcnow() + timedelta(minutes=settings.Settings.ACCESS_TOKEN_MINUTES),
             'iat': datetime.utcnow(),
             'user_id': user_id
         }
@@ -35,6 +107,64 @@ class AuthHandler:
             algorithm=cls.algorithm,
         )
 
+    @classmethod
+    def _refresh_token_id(cls, refresh_token: str) -> str:
+        return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+    @classmethod
+    def _refresh_token_expiry(cls) -> datetime:
+        return datetime.utcnow() + timedelta(days=settings.Settings.REFRESH_TOKEN_DAYS)
+
+    @classmethod
+    async def issue_refresh_token(cls, user_id: int, session: AsyncSession | None = None) -> str:
+        refresh_token = secrets.token_urlsafe(32)
+        await dao.create_refresh_token(
+            cls._refresh_token_id(refresh_token),
+            user_id,
+            cls._refresh_token_expiry(),
+            session=session
+        )
+        return refresh_token
+
+    @classmethod
+    async def rotate_refresh_token(cls, refresh_token: str, session: AsyncSession | None = None) -> tuple | None:
+        # returns (user_id, access token, new refresh token), or None if the refresh token is unknown or expired
+        new_refresh_token = secrets.token_urlsafe(32)
+        user_id = await dao.rotate_refresh_token(
+            cls._refresh_token_id(refresh_token),
+            cls._refresh_token_id(new_refresh_token),
+            cls._refresh_token_expiry(),
+            session=session
+        )
+        if user_id is None:
+            return None
+        return user_id, await cls.encode_token(user_id), new_refresh_token
+
+    @classmethod
+    async def revoke_refresh_token(cls, refresh_token: str, session: AsyncSession | None = None):
+        await dao.delete_refresh_token(cls._refresh_token_id(refresh_token), session=session)
+
+    @classmethod
+    async def login(cls, response: Response, user_id: int, session: AsyncSession | None = None):
+        token = await cls.encode_token(user_id)
+        refresh_token = await cls.issue_refresh_token(user_id, session=session)
+        cls.set_auth_cookies(response, token, refresh_token)
+
+    @classmethod
+    def set_auth_cookies(cls, response: Response, token: str, refresh_token: str):
+        response.set_cookie(key='token', value=token, httponly=True, max_age=settings.Settings.ACCESS_TOKEN_MINUTES * 60)
+        response.set_cookie(
+            key='refresh_token',
+            value=refresh_token,
+            httponly=True,
+            max_age=settings.Settings.REFRESH_TOKEN_DAYS * 24 * 60 * 60
+        )
+
+    @classmethod
+    def delete_auth_cookies(cls, response: Response):
+        response.delete_cookie('token')
+        response.delete_cookie('refresh_token')
+
     @classmethod
     async def decode_token(cls, token: str) -> dict:
         try:
@@ -58,8 +188,11 @@ class AuthHandler:
 
 class AuthLibrary:
     @classmethod
-    async def authenticate_user(cls, login: EmailStr, password: str):
-        user = await dao.get_user_by_login(login)
+    async def authenticate_user(cls, login: EmailStr, password: str, session: AsyncSession | None = None):
+        user = await dao.get_user_by_login(login, session=session)
+        if session is not None:
+            # ends the transaction, so the request's pooled connection isn't held through the password hash
+            await session.commit()
         if not (user and await AuthHandler.verify_password(password, user.password)):
             raise HTTPException(
                 status_code=status.HTTP_406_NOT_ACCEPTABLE,
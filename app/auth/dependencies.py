@@ -2,10 +2,38 @@ from fastapi import Depends, HTTPException, Request, status
 
 import dao
 from app.auth import auth_lib
+from database import get_session
 
 
-async def get_token(request: Request):
+async def get_token_web(request: Request):
     token = request.cookies.get('token')
+    return token
+
+
+async def renew_tokens(request: Request):
+    # Silent renewal from the refresh_token cookie. Rotation commits on its own session so a failing
+    # request cannot undo it; the new cookies are set (or dead ones cleared) by the auth cookie middleware.
+    refresh_token = request.cookies.get('refresh_token')
+    if not refresh_token:
+        return None
+    rotated = await auth_lib.AuthHandler.rotate_refresh_token(refresh_token)
+    if not rotated:
+        # a dead cookie would otherwise cost a rotation attempt on every request
+        request.state.clear_auth_cookies = True
+        return None
+    _, token, new_refresh_token = rotated
+    request.state.auth_cookies = (token, new_refresh_token)
+    return token
+
+
+async def get_token_optional(request: Request, token=Depends(get_token_web)):
+    payload = await auth_lib.AuthHandler.decode_token_web(token)
+    if not payload.get('user_id'):
+        token = await renew_tokens(request) or token
+    return token
+
+
+async def get_token(token=Depends(get_token_optional)):
     if not token:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
@@ -14,12 +42,7 @@ async def get_token(request: Request):
     return token
 
 
-async def get_token_web(request: Request):
-    token = request.cookies.get('token')
-    return token
-
-
-async def get_current_user_required(token=Depends(get_token)):
+async def get_current_user_required(token=Depends(get_token), session=Depends(get_session)):
     payload = await auth_lib.AuthHandler.decode_token(token)
     user_id = payload.get('user_id')
     if not user_id:
@@ -28,7 +51,7 @@ async def get_current_user_required(token=Depends(get_token)):
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail='user_id not presented'
         )
-    user = await dao.get_user_by_id(int(user_id))
+    user = await dao.get_cached_user(int(user_id), session=session)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
@@ -37,13 +60,22 @@ async def get_current_user_required(token=Depends(get_token)):
     return user
 
 
-async def get_current_user_optional(token=Depends(get_token_web)):
+async def get_current_user_optional(token=Depends(get_token_optional), session=Depends(get_session)):
     payload = await auth_lib.AuthHandler.decode_token_web(token)
 
     user_id = payload.get('user_id')
     if not user_id:
         return None
-    user = await dao.get_user_by_id(int(user_id))
+    user = await dao.get_cached_user(int(user_id), session=session)
     if not user:
         return None
     return user
+
+
+async def get_current_superuser(user=Depends(get_current_user_required)):
+    if not user.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Superuser rights required'
+        )
+    return user
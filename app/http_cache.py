@@ -0,0 +1,81 @@
+import datetime
+import hashlib
+import json
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+
+from fastapi import Request, Response, status
+
+from app import static_files
+from cache import CachedResponse, ResponseCache
+from settings import Settings
+
+TEMPLATES_DIR = Path(__file__).parent / 'templates'
+
+
+def _templates_digest() -> str:
+    # html etags change with the templates and asset urls, so a deploy never serves a stale page
+    digest = hashlib.sha1()
+    for path in sorted(TEMPLATES_DIR.rglob('*.html')):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    digest.update(json.dumps(static_files.manifest, sort_keys=True).encode())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_DIGEST = _templates_digest()
+
+# rendered anonymous responses, keyed by route and query and tied to the catalog version
+response_cache = ResponseCache(Settings.RESPONSE_CACHE_MAX_BYTES)
+
+
+def make_etag(*parts, html: bool = False) -> str:
+    if html:
+        parts = (*parts, TEMPLATES_DIGEST)
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime.datetime) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return etag in tags
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return _as_utc(last_modified) <= _as_utc(since)
+    return False
+
+
+def validator_headers(etag: str, last_modified: datetime.datetime) -> dict:
+    return {
+        'ETag': etag,
+        'Last-Modified': format_datetime(_as_utc(last_modified), usegmt=True),
+        'Cache-Control': 'no-cache',
+    }
+
+
+def not_modified(etag: str, last_modified: datetime.datetime) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=validator_headers(etag, last_modified))
+
+
+def to_cached(response: Response) -> CachedResponse:
+    headers = {key: value for key, value in response.headers.items() if key.lower().startswith('x-')}
+    return CachedResponse(body=response.body, media_type=response.media_type, headers=headers)
+
+
+def from_cached(entry: CachedResponse, headers: dict | None = None) -> Response:
+    return Response(content=entry.body, media_type=entry.media_type, headers={**entry.headers, **(headers or {})})
@@ -1,20 +1,64 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 
+from fastapi import FastAPI, Request
+from fastapi.middleware.gzip import GZipMiddleware
+
+import events
 from app.api import router_api
+from app.auth.auth_lib import AuthHandler
 from app.sockets import router_websocket
+from app.static_files import PrecompressedStaticFiles
 from app.web_pages import router_web_pages
+from settings import Settings
+from view_counter import view_counter
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    view_counter.start()
+    await router_websocket.manager.start()
+    events.add_listener(router_websocket.publish_recipe_events)
+    yield
+    events.remove_listener(router_websocket.publish_recipe_events)
+    await router_websocket.manager.stop()
+    await view_counter.stop()
+
 
 app = FastAPI(
     title='BoneRecipes',
     description="I'm not a writer, sorry.",
     version='0.0.1',
-    debug=True
+    debug=True,
+    lifespan=lifespan
 )
 
+if BrotliMiddleware is not None:
+    # falls back to gzip for clients that do not accept br
+    app.add_middleware(BrotliMiddleware, minimum_size=Settings.COMPRESSION_MINIMUM_SIZE)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=Settings.COMPRESSION_MINIMUM_SIZE)
+
+
+@app.middleware('http')
+async def set_renewed_auth_cookies(request: Request, call_next):
+    # tokens renewed by the auth dependencies, set here so they also reach TemplateResponse/RedirectResponse
+    response = await call_next(request)
+    if auth_cookies := getattr(request.state, 'auth_cookies', None):
+        AuthHandler.set_auth_cookies(response, *auth_cookies)
+    elif getattr(request.state, 'clear_auth_cookies', False):
+        # unless the request itself logged in again
+        if not any(cookie.startswith('refresh_token=') for cookie in response.headers.getlist('set-cookie')):
+            AuthHandler.delete_auth_cookies(response)
+    return response
+
 
 app.include_router(router_web_pages.router)
 app.include_router(router_websocket.router)
 app.include_router(router_api.router)
 
-app.mount("/app/static/", StaticFiles(directory='app/static'), name='static')
+app.mount("/app/static/", PrecompressedStaticFiles(directory='app/static'), name='static')
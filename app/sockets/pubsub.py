@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+
+import asyncpg
+
+import dao
+from database import async_session_maker, engine
+from settings import Settings
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'ws_broadcast'
+# postgres rejects NOTIFY payloads of 8000 bytes and more, keep room for the prefix
+MAX_NOTIFY_PAYLOAD = 7900
+INLINE_PREFIX = 'm'
+STORED_PREFIX = 'r'
+
+
+class LocalBackend:
+    """Delivers messages within this process only, for a single worker."""
+
+    def __init__(self):
+        self._handler = None
+        self._seq = itertools.count(1)
+
+    async def start(self, handler):
+        self._handler = handler
+
+    async def stop(self):
+        self._handler = None
+
+    async def publish(self, channel: str, message: str):
+        await self.publish_many([(channel, message)])
+
+    async def publish_many(self, messages: list[tuple[str, str]]):
+        if self._handler is not None:
+            for channel, message in messages:
+                self._handler(next(self._seq), channel, message)
+
+
+class PostgresBackend:
+    """
+    Fans messages out to every worker through Postgres LISTEN/NOTIFY.
+
+    Each worker keeps one dedicated asyncpg connection that LISTENs and
+    reconnects when it drops. Messages too large for a NOTIFY payload are
+    stored in the ws_message table and only their id is sent. Sequence
+    numbers come from a Postgres sequence, so they match in every worker.
+    The same connection receives the user cache invalidations from dao.
+    """
+
+    def __init__(self, dsn: str, reconnect_delay: float = 1):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self._handler = None
+        self._payloads: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, handler):
+        self._handler = handler
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._deliver())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+
+    async def publish(self, channel: str, message: str):
+        await self.publish_many([(channel, message)])
+
+    async def publish_many(self, messages: list[tuple[str, str]]):
+        # one transaction, the notifications are delivered together on commit
+        async with async_session_maker() as session, session.begin():
+            seqs = await dao.next_ws_message_seqs(len(messages), session=session)
+            for seq, (channel, message) in zip(seqs, messages):
+                body = json.dumps([seq, channel, message])
+                if len(body.encode()) > MAX_NOTIFY_PAYLOAD:
+                    message_id = await dao.create_ws_message(body, session=session)
+                    payload = f'{STORED_PREFIX}{message_id}'
+                else:
+                    payload = f'{INLINE_PREFIX}{body}'
+                await dao.notify(NOTIFY_CHANNEL, payload, session=session)
+
+    async def _listen(self):
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                logger.warning('Cannot open the LISTEN connection, retrying', exc_info=True)
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            try:
+                await connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                await connection.add_listener(dao.USER_CACHE_CHANNEL, self._on_user_invalidated)
+                # invalidations sent while no connection was listening are lost
+                dao.clear_user_cache()
+                await closed.wait()
+                logger.warning('LISTEN connection lost, reconnecting')
+            finally:
+                with contextlib.suppress(Exception):
+                    await connection.close(timeout=1)
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        self._payloads.put_nowait(payload)
+
+    def _on_user_invalidated(self, connection, pid, channel, payload: str):
+        dao.forget_cached_user(int(payload))
+
+    async def _deliver(self):
+        # one consumer keeps the delivery order even when a stored message has to be fetched
+        while True:
+            payload = await self._payloads.get()
+            try:
+                if payload.startswith(STORED_PREFIX):
+                    body = await dao.get_ws_message(int(payload[len(STORED_PREFIX):]))
+                    if body is None:
+                        continue
+                else:
+                    body = payload[len(INLINE_PREFIX):]
+                seq, channel, message = json.loads(body)
+                self._handler(seq, channel, message)
+            except Exception:
+                logger.exception('Failed to deliver a websocket message')
+
+
+def create_backend():
+    if Settings.WS_PUBSUB_BACKEND == 'local':
+        return LocalBackend()
+    dsn = engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+    return PostgresBackend(dsn)
@@ -1,37 +1,316 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+import contextlib
+import json
+import logging
+import re
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, status
+
+from settings import Settings
+
+from . import pubsub
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop', 'skip')
+# every client is subscribed to it, plain text messages go there
+GLOBAL_CHANNEL = 'global'
+# recipe change events from dao, only the server publishes to these
+RECIPE_CHANNEL_PREFIX = 'recipe:'
+CHANNEL_PATTERN = re.compile(r'[\w:.-]{1,100}')
+
+
+@dataclass
+class _ChannelHistory:
+    # (seq, message, size in bytes)
+    messages: deque
+    # seq of the newest message that fell out of the buffer
+    dropped_seq: int = 0
+
+
+class MessageHistory:
+    """
+    The last `size` messages with their seq numbers for at most `max_channels`
+    channels, `max_bytes` of messages in total; the channel published to least
+    recently is forgotten first.
+    """
+
+    def __init__(self, size: int, max_channels: int, max_bytes: int):
+        self.size = size
+        self.max_channels = max_channels
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # newest seq of any forgotten channel, replays of unknown channels before it are incomplete
+        self.dropped_seq = 0
+        self._channels: OrderedDict[str, _ChannelHistory] = OrderedDict()
+
+    def append(self, seq: int, channel: str, message: str):
+        history = self._channels.get(channel)
+        if history is None:
+            history = self._channels[channel] = _ChannelHistory(deque())
+        else:
+            self._channels.move_to_end(channel)
+        size = len(message.encode())
+        history.messages.append((seq, message, size))
+        self.bytes += size
+
+        if len(history.messages) > self.size:
+            self._drop_oldest(history)
+        while len(self._channels) > self.max_channels or (self.bytes > self.max_bytes and len(self._channels) > 1):
+            self._forget_oldest_channel()
+        # a single channel over the budget keeps only what fits
+        while self.bytes > self.max_bytes and history.messages:
+            self._drop_oldest(history)
+
+    def _drop_oldest(self, history: _ChannelHistory):
+        seq, _, size = history.messages.popleft()
+        history.dropped_seq = seq
+        self.bytes -= size
+
+    def _forget_oldest_channel(self):
+        _, forgotten = self._channels.popitem(last=False)
+        if forgotten.messages:
+            self.dropped_seq = max(self.dropped_seq, forgotten.messages[-1][0])
+        self.dropped_seq = max(self.dropped_seq, forgotten.dropped_seq)
+        self.bytes -= sum(size for _, _, size in forgotten.messages)
+
+    def since(self, channel: str, seq: int) -> tuple[list, bool]:
+        """Messages after `seq` and whether older ones the client missed are gone."""
+        history = self._channels.get(channel)
+        if history is None:
+            return [], seq < self.dropped_seq
+        return [(s, message) for s, message, _ in history.messages if s > seq], seq < history.dropped_seq
+
+
+def _frame(seq: int | None, channel: str | None, message: str, plain_global: bool) -> str:
+    # global and personal (channel None) frames stay plain text for clients that know nothing about channels
+    if channel is None or (plain_global and channel == GLOBAL_CHANNEL):
+        return message
+    return json.dumps({'channel': channel, 'seq': seq, 'message': message})
+
+
+class Connection:
+    """A websocket with its own bounded send queue drained by a writer task."""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, coalesce_delay: float | None = None, plain_global: bool = True):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[tuple[int | None, str | None, str]] = asyncio.Queue(maxsize=queue_size)
+        self.coalesce_delay = coalesce_delay
+        self.plain_global = plain_global
+        self.channels: set[str] = set()
+        self.skipped = 0
+        self._writer: asyncio.Task | None = None
+        self._closer: asyncio.Task | None = None
+
+    def start(self, on_error):
+        self._writer = asyncio.create_task(self._write(on_error))
+
+    async def _write(self, on_error):
+        try:
+            while True:
+                seq, channel, message = await self.queue.get()
+                if self.coalesce_delay is None:
+                    await self.websocket.send_text(_frame(seq, channel, message, self.plain_global))
+                    continue
+
+                # whatever arrives within the delay goes out as one JSON array frame
+                await asyncio.sleep(self.coalesce_delay)
+                items = [(seq, channel, message)]
+                while not self.queue.empty():
+                    items.append(self.queue.get_nowait())
+                await self.websocket.send_text(json.dumps([{'channel': c, 'seq': s, 'message': m} for s, c, m in items]))
+        except Exception:
+            on_error(self)
+
+    def stop(self):
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    def abort(self, code: int):
+        self.stop()
+        self._closer = asyncio.create_task(self._close(code))
+
+    async def _close(self, code: int):
+        with contextlib.suppress(Exception):
+            await self.websocket.close(code=code)
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    """
+    Keeps the open websockets by channel and fans messages out to them.
+
+    Sending never blocks the caller: every connection has a bounded queue,
+    and a client whose queue is full is either disconnected ('drop') or
+    misses that message ('skip'), so a slow client can't stall the others.
+
+    `publish` goes through the pub/sub backend, which hands the message with
+    its seq number to `broadcast` in every worker. Recent messages are kept
+    in a bounded history, so a reconnecting client can ask for what it missed.
+    """
+
+    def __init__(self, queue_size: int, overflow_policy: str, backend, history: MessageHistory):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow_policy}, expected one of: {", ".join(OVERFLOW_POLICIES)}.')
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.backend = backend
+        self.history = history
+        self.active_connections: set[Connection] = set()
+        self.channels: dict[str, set[Connection]] = {}
+
+    async def start(self):
+        await self.backend.start(self.broadcast)
 
-    async def connect(self, websocket: WebSocket):
+    async def stop(self):
+        await self.backend.stop()
+
+    async def publish(self, channel: str, message: str):
+        await self.backend.publish(channel, message)
+
+    async def publish_many(self, messages: list[tuple[str, str]]):
+        await self.backend.publish_many(messages)
+
+    async def connect(self, websocket: WebSocket, coalesce: bool = False, since: int | None = None) -> Connection:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        # clients asking for a replay need the seq numbers, so they get JSON frames on the global channel too
+        connection = Connection(
+            websocket,
+            self.queue_size,
+            coalesce_delay=Settings.WS_COALESCE_MS / 1000 if coalesce else None,
+            plain_global=since is None
+            )
+        connection.start(self.disconnect)
+        self.active_connections.add(connection)
+        self.subscribe(connection, GLOBAL_CHANNEL, since)
+        return connection
+
+    def disconnect(self, connection: Connection):
+        self.active_connections.discard(connection)
+        for channel in list(connection.channels):
+            self.unsubscribe(connection, channel)
+        connection.stop()
+
+    def subscribe(self, connection: Connection, channel: str, since: int | None = None):
+        connection.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(connection)
+        if since is None:
+            return
+        # no await between subscribing and replaying, so nothing is missed or sent twice
+        messages, truncated = self.history.since(channel, since)
+        if truncated:
+            self.send_personal_message(json.dumps({'channel': channel, 'history_truncated': True}), connection)
+        for seq, message in messages:
+            self._enqueue(seq, channel, message, connection)
+
+    def unsubscribe(self, connection: Connection, channel: str):
+        connection.channels.discard(channel)
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.channels[channel]
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    def send_personal_message(self, message: str, connection: Connection):
+        self._enqueue(None, None, message, connection)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    def broadcast(self, seq: int, channel: str, message: str):
+        self.history.append(seq, channel, message)
+        for connection in list(self.channels.get(channel, ())):
+            self._enqueue(seq, channel, message, connection)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    def _enqueue(self, seq: int | None, channel: str | None, message: str, connection: Connection):
+        try:
+            connection.queue.put_nowait((seq, channel, message))
+        except asyncio.QueueFull:
+            if self.overflow_policy == 'skip':
+                connection.skipped += 1
+                return
+            logger.info('Dropping websocket client with %d unsent messages', connection.queue.qsize())
+            self.disconnect(connection)
+            connection.abort(status.WS_1013_TRY_AGAIN_LATER)
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    Settings.WS_SEND_QUEUE_SIZE,
+    Settings.WS_OVERFLOW_POLICY,
+    pubsub.create_backend(),
+    MessageHistory(Settings.WS_HISTORY_SIZE, Settings.WS_HISTORY_CHANNELS, Settings.WS_HISTORY_MAX_BYTES)
+    )
 
 router = APIRouter(
     prefix='/ws',
 )
 
+_publish_tasks: set[asyncio.Task] = set()
+
+
+def _publish_done(task: asyncio.Task):
+    _publish_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Failed to publish recipe events', exc_info=task.exception())
+
+
+def publish_recipe_events(changes: list[dict]):
+    # events listener: every change goes to its recipe's channel, which the pages showing that recipe subscribe to
+    messages = [
+        (f'{RECIPE_CHANNEL_PREFIX}{change["id"]}', json.dumps([change]))
+        for change in changes if change['type'] in ('updated', 'deleted', 'popularity')
+        ]
+    if not messages:
+        return
+    task = asyncio.get_running_loop().create_task(manager.publish_many(messages))
+    _publish_tasks.add(task)
+    task.add_done_callback(_publish_done)
+
+
+def _error(connection: Connection, error: str):
+    manager.send_personal_message(json.dumps({'error': error}), connection)
+
+
+async def handle_message(connection: Connection, text: str):
+    # JSON objects with an action manage subscriptions, anything else is a chat line for the global channel
+    if len(text.encode()) > Settings.WS_MAX_MESSAGE_BYTES:
+        return _error(connection, f'Messages are limited to {Settings.WS_MAX_MESSAGE_BYTES} bytes.')
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or 'action' not in data:
+        await manager.publish(GLOBAL_CHANNEL, f" says: {text}")
+        return
+
+    action, channel = data.get('action'), data.get('channel')
+    if not isinstance(channel, str) or not CHANNEL_PATTERN.fullmatch(channel):
+        return _error(connection, 'Field channel must be 1-100 letters, digits or ":._-".')
+
+    if action == 'subscribe':
+        if len(connection.channels) >= Settings.WS_MAX_SUBSCRIPTIONS and channel not in connection.channels:
+            return _error(connection, f'At most {Settings.WS_MAX_SUBSCRIPTIONS} subscriptions are allowed.')
+        since = data.get('since')
+        if since is not None and (not isinstance(since, int) or isinstance(since, bool)):
+            return _error(connection, 'Field since must be a seq number.')
+        manager.subscribe(connection, channel, since)
+    elif action == 'unsubscribe':
+        manager.unsubscribe(connection, channel)
+    elif action == 'send':
+        if channel.startswith(RECIPE_CHANNEL_PREFIX):
+            return _error(connection, f'Channel {channel} is read-only.')
+        if not isinstance(data.get('message'), str):
+            return _error(connection, 'Field message must be a string.')
+        await manager.publish(channel, data['message'])
+    else:
+        _error(connection, f'Unknown action {action}, expected subscribe, unsubscribe or send.')
+
 
 @router.websocket('/')
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, coalesce: bool = Query(False), since: int | None = Query(None)):
+    connection = await manager.connect(websocket, coalesce=coalesce, since=since)
     try:
         while True:
-            await manager.broadcast(f" says: {await websocket.receive_text()}")
+            await handle_message(connection, await websocket.receive_text())
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        manager.disconnect(connection)
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import shutil
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = Path(__file__).parent / 'static'
+DIST_DIR = STATIC_DIR / 'dist'
+MANIFEST_PATH = DIST_DIR / 'manifest.json'
+STATIC_URL = '/app/static/'
+
+COMPRESSIBLE_SUFFIXES = ('.css', '.js', '.svg', '.json', '.txt', '.ico')
+# preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _load_manifest() -> dict:
+    try:
+        return json.loads(MANIFEST_PATH.read_text())
+    except FileNotFoundError:
+        return {}
+
+
+manifest = _load_manifest()
+
+
+def asset_url(path: str) -> str:
+    # hashed dist/ file when the build step was run, the source file otherwise
+    return STATIC_URL + manifest.get(path, path)
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for item in accept_encoding.split(','):
+        encoding, _, params = item.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves the `.br`/`.gz` variant written by the build step
+    when the client accepts it, and marks content-hashed dist/ files immutable.
+    """
+
+    async def get_response(self, path: str, scope):
+        response = None
+        accepted = _accepted_encodings(Headers(scope=scope).get('accept-encoding', ''))
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except HTTPException:
+                continue
+            if response.status_code in (200, 304):
+                response.headers['content-encoding'] = encoding
+                response.headers['content-type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+                break
+            response = None
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            response.headers['vary'] = 'Accept-Encoding'
+            if Path(path).parts[:1] == ('dist',):
+                response.headers['cache-control'] = 'public, max-age=31536000, immutable'
+        return response
+
+
+def build() -> dict:
+    """Copy static files into dist/ under content-hashed names and precompress them."""
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    built = {}
+    for source in sorted(STATIC_DIR.rglob('*')):
+        if not source.is_file() or DIST_DIR in source.parents:
+            continue
+        relative = source.relative_to(STATIC_DIR)
+        content = source.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()[:10]
+        target = DIST_DIR / relative.with_name(f'{relative.stem}.{digest}{relative.suffix}')
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+
+        if source.suffix in COMPRESSIBLE_SUFFIXES:
+            variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(content, quality=11)
+            for suffix, compressed in variants.items():
+                # not worth a variant when compression does not pay off
+                if len(compressed) < len(content):
+                    target.with_name(target.name + suffix).write_bytes(compressed)
+
+        built[relative.as_posix()] = target.relative_to(STATIC_DIR).as_posix()
+
+    MANIFEST_PATH.write_text(json.dumps(built, indent=2))
+    return built
+
+
+if __name__ == '__main__':
+    for source, target in build().items():
+        print(f'{source} -> {target}')
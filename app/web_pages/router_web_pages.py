@@ -9,8 +9,11 @@ from pydantic import EmailStr
 
 import dao
 import settings
+from app import http_cache, static_files
 from app.auth import dependencies
 from app.auth.auth_lib import AuthHandler, AuthLibrary
+from database import get_session
+from view_counter import view_counter
 
 router = APIRouter(
     tags=['menu', 'landing'],
@@ -18,6 +21,7 @@ router = APIRouter(
 )
 
 templates = Jinja2Templates(directory='app\\templates')
+templates.env.globals['asset'] = static_files.asset_url
 
 
 @router.get('/menu')
@@ -28,36 +32,73 @@ async def get_menu(request: Request,
                    saved: bool = Query(False),
                    categories: List[int] = Query([]),
                    page: int = Query(0),
+                   session=Depends(get_session),
                    user=Depends(dependencies.get_current_user_optional)
                    ):
-    if saved:
-        if user:
-            all_fetched_recipes = await dao.fetch_saved_recipes(user.id)
-        else:
-            status_code = status.HTTP_403_FORBIDDEN
-            context = {
-                'request': request,
-                'title': 'User error',
-                'content': 'You must be logged in to view saved recipes.',
-                'code': status_code,
-                'user': user,
-            }
+    if saved and not user:
+        status_code = status.HTTP_403_FORBIDDEN
+        context = {
+            'request': request,
+            'title': 'User error',
+            'content': 'You must be logged in to view saved recipes.',
+            'code': status_code,
+            'user': user,
+        }
 
-            return templates.TemplateResponse(
-                '400.html',
-                context=context,
-                status_code=status_code
+        return templates.TemplateResponse(
+            '400.html',
+            context=context,
+            status_code=status_code
+        )
+
+    if user:
+        return await render_menu(request, sort, dish_name, saved, categories, page, session, user)
+
+    # pages rendered for a user differ by the saved marks, so only anonymous pages are revalidated and cached
+    catalog = await dao.get_catalog_version(session=session)
+    etag = http_cache.make_etag('menu', catalog.version, sort, dish_name, categories, page, html=True)
+    if http_cache.is_not_modified(request, etag, catalog.updated_at):
+        return http_cache.not_modified(etag, catalog.updated_at)
+
+    async def render():
+        return http_cache.to_cached(
+            await render_menu(request, sort, dish_name, False, categories, page, session, None, catalog_version=catalog.version)
             )
-    else:
-        all_fetched_recipes = await dao.fetch_recipes()
-    recipes = []
-    skip = page * settings.Settings.NUM_RECIPES_ON_PAGE
-    filtered_recipes = []
-    fetched_categories = await dao.fetch_categories()
+
+    entry = await http_cache.response_cache.get_or_render(
+        ('menu.html', sort, dish_name, tuple(categories), page),
+        catalog.version,
+        render
+        )
+    return http_cache.from_cached(entry, http_cache.validator_headers(etag, catalog.updated_at))
+
+
+async def render_menu(
+        request: Request,
+        sort: str,
+        dish_name: str,
+        saved: bool,
+        categories: List[int],
+        page: int,
+        session,
+        user,
+        catalog_version: int | None = None
+        ):
+    menu_page = await dao.fetch_menu(
+        sort=sort,
+        dish_name=dish_name,
+        categories=categories,
+        page=page,
+        saver_id=user.id if saved else None,
+        session=session
+        )
+    fetched_categories = await dao.fetch_categories(session=session, catalog_version=catalog_version)
+    category_names = await dao.fetch_category_names(session=session, catalog_version=catalog_version)
     context = {
         'request': request,
         'user': user,
         'categories': fetched_categories,
+        'category_names': category_names,
         'page': page,
         'sort': sort,
         'title': ('Saved' if saved else 'All') + ' recipes',
@@ -67,38 +108,19 @@ async def get_menu(request: Request,
     }
 
     if categories:
-        filtered_recipes = list(filter(
-            lambda x: x[0].categories and set(x[0].categories).issubset(set(categories)),
-            all_fetched_recipes))
         context['title'] = ('Saved recipes' if saved else 'Recipes')\
-            + f' with categor{"ies" if len(categories) > 1 else "y"} {", ".join([fetched_categories[id - 1][0].name for id in categories])}'
-    else:
-        filtered_recipes = all_fetched_recipes
+            + f' with categor{"ies" if len(categories) > 1 else "y"} '\
+            + ", ".join([category_names[id] for id in categories if id in category_names])
 
     if re.sub(r"\s+", '', dish_name):
-        context["dish_name"] = dish_name
-        for dish in filtered_recipes:
-            if dish_name.lower() in dish[0].name.lower():
-                recipes.append(dish)
         context['title'] = f'{dish_name} search results' + (' in saved recipes' if saved else '')
-    else:
-        recipes = filtered_recipes
-
-    if sort == "popularity-asc":
-        recipes = sorted(recipes, key=lambda x: x[0].popularity)
-    elif sort == "popularity-desc":
-        recipes = sorted(recipes, key=lambda x: x[0].popularity, reverse=True)
-    elif sort == "a-z":
-        recipes = sorted(recipes, key=lambda x: x[0].name.lower())
-    elif sort == "z-a":
-        recipes = sorted(recipes, key=lambda x: x[0].name.lower(), reverse=True)
 
-    recipes = recipes[skip:skip + settings.Settings.NUM_RECIPES_ON_PAGE]
-
-    context['menu'] = recipes
+    context['menu'] = menu_page.recipes
+    context['saved_ids'] = await dao.fetch_saved_recipe_ids(user.id, [recipe[0].id for recipe in menu_page.recipes], session=session)\
+        if user else set()
     context['previous_page'] = page - 1
 
-    if skip < len(recipes) // settings.Settings.NUM_RECIPES_ON_PAGE:
+    if (page + 1) * settings.Settings.NUM_RECIPES_ON_PAGE < menu_page.total:
         context['next_page'] = page + 1
 
     return templates.TemplateResponse(
@@ -115,11 +137,12 @@ async def create_recipe_final(
     description: str = Form(),
     recipe: str = Form(),
     categories: List[int] = Form([]),
+    session=Depends(get_session),
     user=Depends(dependencies.get_current_user_optional)
 ):
     if user:
 
-        if await dao.get_recipe_by_name(name):
+        if await dao.get_recipe_by_name(name, session=session):
             status_code = status.HTTP_406_NOT_ACCEPTABLE
             context = {
                 'request': request,
@@ -140,7 +163,8 @@ async def create_recipe_final(
             image=image,
             recipe=recipe,
             categories=categories,
-            creator_id=user.id)).id
+            creator_id=user.id,
+            session=session)).id
 
         return RedirectResponse(f"/recipe/{recipe_id}")
 
@@ -169,11 +193,12 @@ async def update_recipe_final(
     description: str = Form(),
     recipe: str = Form(),
     categories: List[int] = Form([]),
+    session=Depends(get_session),
     user=Depends(dependencies.get_current_user_optional)
 ):
     if user:
 
-        if not (recipe_object := await dao.get_recipe_by_id(recipe_id)):
+        if not (recipe_object := await dao.get_recipe_by_id(recipe_id, session=session)):
             status_code = status.HTTP_404_NOT_FOUND
             context = {
                 'request': request,
@@ -205,7 +230,7 @@ async def update_recipe_final(
                 status_code=status_code
             )
 
-        if (recipe_exists := (await dao.get_recipe_by_name(name))) and recipe_exists.id != recipe_id:
+        if (recipe_exists := (await dao.get_recipe_by_name(name, session=session))) and recipe_exists.id != recipe_id:
             status_code = status.HTTP_406_NOT_ACCEPTABLE
             context = {
                 'request': request,
@@ -226,7 +251,8 @@ async def update_recipe_final(
             image=image,
             recipe=recipe,
             categories=categories,
-            recipe_id=recipe_id
+            recipe_id=recipe_id,
+            session=session
             )
 
         return RedirectResponse(f"/recipe/{recipe_id}")
@@ -248,13 +274,13 @@ async def update_recipe_final(
 
 
 @router.get('/create-recipe')
-async def create_recipe(request: Request, user=Depends(dependencies.get_current_user_optional)):
+async def create_recipe(request: Request, session=Depends(get_session), user=Depends(dependencies.get_current_user_optional)):
     if user:
         context = {
             'request': request,
             'title': 'Create new recipe',
             'user': user,
-            'categories': await dao.fetch_categories(),
+            'categories': await dao.fetch_categories(session=session),
         }
 
         return templates.TemplateResponse(
@@ -278,9 +304,14 @@ async def create_recipe(request: Request, user=Depends(dependencies.get_current_
 
 
 @router.get('/update-recipe/{recipe_id}')
-async def update_recipe(request: Request, recipe_id: int, user=Depends(dependencies.get_current_user_optional)):
+async def update_recipe(
+    request: Request,
+    recipe_id: int,
+    session=Depends(get_session),
+    user=Depends(dependencies.get_current_user_optional)
+):
     if user:
-        if not (recipe_object := await dao.get_recipe_by_id(recipe_id)):
+        if not (recipe_object := await dao.get_recipe_by_id(recipe_id, session=session)):
             status_code = status.HTTP_404_NOT_FOUND
             context = {
                 'request': request,
@@ -317,7 +348,7 @@ async def update_recipe(request: Request, recipe_id: int, user=Depends(dependenc
             'recipe': recipe_object,
             'title': f'Update recipe #{recipe_id}',
             'user': user,
-            'categories': await dao.fetch_categories(),
+            'categories': await dao.fetch_categories(session=session),
         }
 
         return templates.TemplateResponse(
@@ -342,8 +373,20 @@ async def update_recipe(request: Request, recipe_id: int, user=Depends(dependenc
 
 @router.get('/recipe/{id}')
 @router.post('/recipe/{id}')
-async def recipe(request: Request, id: int, user=Depends(dependencies.get_current_user_optional)):
-    recipe = await dao.get_recipe_by_id(id)
+async def recipe(request: Request, id: int, session=Depends(get_session), user=Depends(dependencies.get_current_user_optional)):
+    validators = catalog_version = None
+    if not user and (version := await dao.get_recipe_version(id, session=session)):
+        # the page also lists category names, so the catalog version is part of the tag
+        catalog = await dao.get_catalog_version(session=session)
+        catalog_version = catalog.version
+        etag = http_cache.make_etag('recipe', id, version.version, catalog.version, html=True)
+        last_modified = max(version.updated_at, catalog.updated_at)
+        if http_cache.is_not_modified(request, etag, last_modified):
+            view_counter.record(id)
+            return http_cache.not_modified(etag, last_modified)
+        validators = http_cache.validator_headers(etag, last_modified)
+
+    recipe = await dao.get_recipe_by_id(id, session=session)
     if not recipe:
         status_code = status.HTTP_404_NOT_FOUND
 
@@ -361,17 +404,19 @@ async def recipe(request: Request, id: int, user=Depends(dependencies.get_curren
             status_code=status_code
         )
 
-    await dao.increase_recipe_popularity(id)
+    view_counter.record(id)
     context = {
         'request': request,
         'user': user,
         'title': f'Recipe {recipe.name}',
         'recipe': recipe,
-        'categories': await dao.fetch_categories(),
+        'category_names': await dao.fetch_category_names(session=session, catalog_version=catalog_version),
+        'saved_ids': await dao.fetch_saved_recipe_ids(user.id, [recipe.id], session=session) if user else set(),
     }
     return templates.TemplateResponse(
         'recipe.html',
         context=context,
+        headers=validators
     )
 
 
@@ -482,9 +527,9 @@ async def delete_my_account(request: Request, user=Depends(dependencies.get_curr
 
 
 @router.get('/delete-my-account-final')
-async def delete_my_account_final(request: Request, user=Depends(dependencies.get_current_user_optional)):
+async def delete_my_account_final(request: Request, session=Depends(get_session), user=Depends(dependencies.get_current_user_optional)):
     if user:
-        await dao.delete_user(user.id)
+        await dao.delete_user(user.id, session=session)
         return RedirectResponse("/menu/")
     status_code = status.HTTP_403_FORBIDDEN
     context = {
@@ -503,9 +548,14 @@ async def delete_my_account_final(request: Request, user=Depends(dependencies.ge
 
 
 @router.get('/delete-recipe/{recipe_id}')
-async def delete_recipe(request: Request, recipe_id: int, user=Depends(dependencies.get_current_user_optional)):
+async def delete_recipe(
+    request: Request,
+    recipe_id: int,
+    session=Depends(get_session),
+    user=Depends(dependencies.get_current_user_optional)
+):
     if user:
-        if not (recipe_object := await dao.get_recipe_by_id(recipe_id)):
+        if not (recipe_object := await dao.get_recipe_by_id(recipe_id, session=session)):
             status_code = status.HTTP_404_NOT_FOUND
             context = {
                 'request': request,
@@ -567,10 +617,11 @@ async def delete_recipe(request: Request, recipe_id: int, user=Depends(dependenc
 async def delete_recipe_final(
     request: Request,
     recipe_id: int,
+    session=Depends(get_session),
     user=Depends(dependencies.get_current_user_optional)
 ):
     if user:
-        if not (recipe_object := await dao.get_recipe_by_id(recipe_id)):
+        if not (recipe_object := await dao.get_recipe_by_id(recipe_id, session=session)):
             status_code = status.HTTP_404_NOT_FOUND
             context = {
                 'request': request,
@@ -601,7 +652,7 @@ async def delete_recipe_final(
                 context=context,
                 status_code=status_code
             )
-        await dao.delete_recipe(recipe_id)
+        await dao.delete_recipe(recipe_id, session=session)
         return RedirectResponse("/menu/")
 
     status_code = status.HTTP_403_FORBIDDEN
@@ -621,9 +672,9 @@ async def delete_recipe_final(
 
 
 @router.get('/save-recipe/{recipe_id}')
-async def save_recipe(request: Request, recipe_id: int, user=Depends(dependencies.get_current_user_optional)):
+async def save_recipe(request: Request, recipe_id: int, session=Depends(get_session), user=Depends(dependencies.get_current_user_optional)):
     if user:
-        if not await dao.get_recipe_by_id(recipe_id):
+        if not await dao.get_recipe_by_id(recipe_id, session=session):
             status_code = status.HTTP_404_NOT_FOUND
             context = {
                 'request': request,
@@ -638,7 +689,7 @@ async def save_recipe(request: Request, recipe_id: int, user=Depends(dependencie
                 context=context,
                 status_code=status_code
             )
-        await dao.save_recipe(recipe_id, user.id)
+        await dao.save_recipe(recipe_id, user.id, session=session)
         return RedirectResponse("/menu?saved=True")
 
     status_code = status.HTTP_403_FORBIDDEN
@@ -658,9 +709,14 @@ async def save_recipe(request: Request, recipe_id: int, user=Depends(dependencie
 
 
 @router.get('/unsave-recipe/{recipe_id}')
-async def unsave_recipe(request: Request, recipe_id: int, user=Depends(dependencies.get_current_user_optional)):
+async def unsave_recipe(
+    request: Request,
+    recipe_id: int,
+    session=Depends(get_session),
+    user=Depends(dependencies.get_current_user_optional)
+):
     if user:
-        if not await dao.get_recipe_by_id(recipe_id):
+        if not await dao.get_recipe_by_id(recipe_id, session=session):
             status_code = status.HTTP_404_NOT_FOUND
             context = {
                 'request': request,
@@ -675,7 +731,7 @@ async def unsave_recipe(request: Request, recipe_id: int, user=Depends(dependenc
                 context=context,
                 status_code=status_code
             )
-        await dao.unsave_recipe(recipe_id, user.id)
+        await dao.unsave_recipe(recipe_id, user.id, session=session)
         return RedirectResponse("/menu?saved=True")
 
     status_code = status.HTTP_403_FORBIDDEN
@@ -701,6 +757,7 @@ async def register_final(request: Request,
                          email: EmailStr = Form(),
                          notes: str = Form(default=''),
                          password: str = Form(),
+                         session=Depends(get_session),
                          user=Depends(dependencies.get_current_user_optional)
                          ):
     if re.search(r"\s", login):
@@ -722,7 +779,10 @@ async def register_final(request: Request,
     if user:
         return RedirectResponse("/menu/")
 
-    is_login_already_used = await dao.get_user_by_login(login)
+    # hashed before the lookups, so the request session holds no connection while it runs
+    hashed_password = await AuthHandler.get_password_hash(password)
+
+    is_login_already_used = await dao.get_user_by_login(login, session=session)
     if is_login_already_used:
         status_code = status.HTTP_406_NOT_ACCEPTABLE
         context = {
@@ -739,7 +799,7 @@ async def register_final(request: Request,
             status_code=status_code
         )
 
-    is_email_already_used = await dao.get_user_by_email(email)
+    is_email_already_used = await dao.get_user_by_email(email, session=session)
     if is_email_already_used:
         status_code = status.HTTP_406_NOT_ACCEPTABLE
         context = {
@@ -756,21 +816,18 @@ async def register_final(request: Request,
             status_code=status_code
         )
 
-    hashed_password = await AuthHandler.get_password_hash(password)
-
     user_data = await dao.create_user(
         name=name,
         login=login,
         email=email,
         password=hashed_password,
         notes=notes,
+        session=session
     )
 
-    token = await AuthHandler.encode_token(user_data[0])
-
     redirect_response = RedirectResponse("/menu")
 
-    redirect_response.set_cookie(key='token', value=token, httponly=True, max_age=1000)
+    await AuthHandler.login(redirect_response, user_data[0], session=session)
 
     return redirect_response
 
@@ -780,12 +837,13 @@ async def login_final(
     request: Request,
     login: str = Form(),
     password: str = Form(),
+    session=Depends(get_session),
     user=Depends(dependencies.get_current_user_optional)
 ):
     response = RedirectResponse("/menu/")
     if not user:
         try:
-            logged_in_user = await AuthLibrary.authenticate_user(login=login, password=password)
+            logged_in_user = await AuthLibrary.authenticate_user(login=login, password=password, session=session)
         except HTTPException as e:
             status_code = e.status_code
             context = {
@@ -802,14 +860,15 @@ async def login_final(
                 status_code=status_code
             )
 
-        token = await AuthHandler.encode_token(logged_in_user.id)
-        response.set_cookie(key='token', value=token, httponly=True, max_age=1000)
+        await AuthHandler.login(response, logged_in_user.id, session=session)
 
     return response
 
 
 @router.get('/logout')
-async def logout(request: Request):
+async def logout(request: Request, session=Depends(get_session)):
     response = RedirectResponse('/menu/')
-    response.delete_cookie('token')
+    if refresh_token := request.cookies.get('refresh_token'):
+        await AuthHandler.revoke_refresh_token(refresh_token, session=session)
+    AuthHandler.delete_auth_cookies(response)
     return response
@@ -0,0 +1,71 @@
+"""
+Renders the category buttons of a menu page both ways: the old nested loop
+over every category per recipe and the category_names lookup menu.html uses.
+
+    python -m benchmarks.bench_menu_render --categories 50 200
+"""
+import argparse
+import random
+import timeit
+from types import SimpleNamespace
+
+from jinja2 import Environment
+
+NESTED_LOOP = """
+{% for recipe in menu %}
+    {% for category in recipe[0].categories %}
+        {% for i in categories %}
+            {% if category == i[0].id %}
+                <a href="?categories={{ category }}" class="btn btn-primary" style="margin:2px">{{ i[0].name }}</a>
+            {% endif %}
+        {% endfor %}
+    {% endfor %}
+{% endfor %}
+"""
+
+NAME_LOOKUP = """
+{% for recipe in menu %}
+    {% for category in recipe[0].categories if category in category_names %}
+        <a href="?categories={{ category }}" class="btn btn-primary" style="margin:2px">{{ category_names[category] }}</a>
+    {% endfor %}
+{% endfor %}
+"""
+
+
+def make_context(num_categories: int, num_recipes: int, categories_per_recipe: int) -> dict:
+    # rows shaped like the query results: one-element tuples of ORM objects
+    categories = [(SimpleNamespace(id=id, name=f'Category {id}'),) for id in range(1, num_categories + 1)]
+    menu = [
+        (SimpleNamespace(categories=random.sample(range(1, num_categories + 1), min(categories_per_recipe, num_categories))),)
+        for _ in range(num_recipes)
+        ]
+    return {
+        'menu': menu,
+        'categories': categories,
+        'category_names': {category[0].id: category[0].name for category in categories},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Menu category rendering: nested loop vs id -> name map.')
+    parser.add_argument('--categories', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--recipes', type=int, default=9)
+    parser.add_argument('--per-recipe', type=int, default=5)
+    parser.add_argument('--number', type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(0)
+    environment = Environment(autoescape=True)
+    nested_loop, name_lookup = environment.from_string(NESTED_LOOP), environment.from_string(NAME_LOOKUP)
+
+    print(f'{"categories":>10} {"nested loop":>14} {"name lookup":>14} {"speedup":>8}')
+    for num_categories in args.categories:
+        context = make_context(num_categories, args.recipes, args.per_recipe)
+        assert nested_loop.render(context).split() == name_lookup.render(context).split()
+        old = min(timeit.repeat(lambda: nested_loop.render(context), number=args.number, repeat=3)) / args.number
+        new = min(timeit.repeat(lambda: name_lookup.render(context), number=args.number, repeat=3)) / args.number
+        print(f'{num_categories:>10} {old * 1e6:>11.1f} us {new * 1e6:>11.1f} us {old / new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
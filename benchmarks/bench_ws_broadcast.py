@@ -0,0 +1,94 @@
+"""
+Broadcasts to 10k in-process fake websockets through ConnectionManager with
+the local pub/sub backend, against the old loop that awaited send_text on
+every connection in turn. A few of the fake clients are slow.
+
+    python -m benchmarks.bench_ws_broadcast --clients 10000 --slow 10
+"""
+import argparse
+import asyncio
+import time
+
+from app.sockets.pubsub import LocalBackend
+from app.sockets.router_websocket import (GLOBAL_CHANNEL, ConnectionManager,
+                                          MessageHistory)
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            # a real send yields to the event loop as well
+            await asyncio.sleep(0)
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def make_sockets(clients: int, slow: int, delay: float) -> list[FakeWebSocket]:
+    return [FakeWebSocket(delay if i < slow else 0) for i in range(clients)]
+
+
+async def sequential(sockets: list[FakeWebSocket], messages: int) -> tuple[float, float]:
+    # the old broadcast: the caller waits for every client, the slow ones included
+    start = time.perf_counter()
+    for i in range(messages):
+        for websocket in sockets:
+            await websocket.send_text(f'message {i}')
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+
+async def queued(sockets: list[FakeWebSocket], messages: int, slow: int, queue_size: int, policy: str) -> tuple[float, float]:
+    manager = ConnectionManager(queue_size, policy, LocalBackend(), MessageHistory(32, 1000, 8 * 1024 * 1024))
+    await manager.start()
+    connections = [await manager.connect(websocket) for websocket in sockets]
+
+    start = time.perf_counter()
+    for i in range(messages):
+        await manager.publish(GLOBAL_CHANNEL, f'message {i}')
+    published = time.perf_counter() - start
+
+    # time until every fast client has everything; slow ones are still draining or got dropped
+    while any(websocket.received < messages for websocket in sockets[slow:]):
+        await asyncio.sleep(0.001)
+    delivered = time.perf_counter() - start
+
+    for connection in connections:
+        manager.disconnect(connection)
+    await manager.stop()
+    return published, delivered
+
+
+async def run(args):
+    print(f'{args.clients} clients, {args.slow} of them {args.delay * 1000:.0f} ms per send, {args.messages} messages')
+    print(f'{"":>22} {"publish":>10} {"delivered":>10}')
+    results = [('sequential send_text', await sequential(make_sockets(args.clients, args.slow, args.delay), args.messages))]
+    for policy in ('drop', 'skip'):
+        sockets = make_sockets(args.clients, args.slow, args.delay)
+        results.append((f'queued ({policy})', await queued(sockets, args.messages, args.slow, args.queue_size, policy)))
+    for name, (published, delivered) in results:
+        print(f'{name:>22} {published * 1000:>7.1f} ms {delivered * 1000:>7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Websocket broadcast: per-connection queues vs sequential sends.')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--slow', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds per send for the slow clients')
+    parser.add_argument('--messages', type=int, default=10)
+    parser.add_argument('--queue-size', type=int, default=64)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
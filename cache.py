@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, generation: int | None = None):
+        # a value loaded before an invalidation (older generation) is dropped, not cached
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: str
+    headers: dict
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered response bodies bounded by their total size in bytes.
+
+    Concurrent misses for the same key share a single render (single-flight).
+    Keys are expected to contain a content version; the first key seen with
+    a newer version drops every entry rendered for an older one.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._pending: dict = {}
+
+    async def get_or_render(self, key, version, render) -> CachedResponse:
+        if version != self.version:
+            if self.version is not None and version < self.version:
+                # a replica lagging behind, render without touching the cache
+                return await render()
+            self.clear()
+            self.version = version
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+
+        while (future := self._pending.get(key)) is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # only retry when the rendering request was cancelled, not this one
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            entry = await render()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when nobody else is waiting for it
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+        future.set_result(entry)
+        if self.version == version:
+            self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry: CachedResponse):
+        if len(entry.body) > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
@@ -1,7 +1,186 @@
-from sqlalchemy import delete, insert, select, text, update
+import asyncio
+import base64
+import binascii
+import datetime
+import json
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from sqlalchemy import (ARRAY, Integer, bindparam, delete, event, exc, func,
+                        insert, or_, select, text, tuple_, update)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import events
+from cache import TTLCache
+from database import (after_commit, async_session_maker, replica_session_maker,
+                      run_after_commit)
+from models import (Category, Recipe, RecipeSave, RefreshToken, User,
+                    WsMessage, catalog_version_seq, ws_message_seq)
+from settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MenuPage:
+    recipes: list
+    total: int | None = None
+    next_cursor: str | None = None
+
+
+@dataclass
+class _CategoryCache:
+    categories: list
+    names: dict
+    expires_at: float
+    # catalog version read before loading, the categories are at least that new
+    catalog_version: int
+
+
+# categories almost never change; cached per process, refreshed after CATEGORY_CACHE_SECONDS
+# or as soon as a caller brings a newer catalog version
+_category_cache: _CategoryCache | None = None
+# bumped by every invalidation, a load that started before one is not cached
+_category_generation = 0
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    id: int
+    login: str
+    name: str
+    is_superuser: bool
+
+
+# per process; writes through dao invalidate it on commit, other workers through a NOTIFY on USER_CACHE_CHANNEL
+_user_cache = TTLCache(maxsize=Settings.USER_CACHE_SIZE, ttl=Settings.USER_CACHE_SECONDS)
+
+
+@asynccontextmanager
+async def _session_scope(session: AsyncSession | None = None, commit: bool = False):
+    # a session passed in (the request's unit of work) is committed by its owner
+    if session is not None:
+        if commit:
+            session.info['has_writes'] = True
+        yield session
+        return
+    async with async_session_maker() as session:
+        yield session
+        if commit:
+            await session.commit()
+            await run_after_commit(session)
+
+
+def _emit(session: AsyncSession, change: dict):
+    # handed to the events listeners once the transaction commits, dropped on rollback
+    session.info.setdefault('events', []).append(change)
+
+
+USER_CACHE_CHANNEL = 'user_cache'
+
+
+async def _invalidate_user(session: AsyncSession, user_id: int):
+    # dropped from the cache only once the change is committed, so a concurrent miss can't cache the old row;
+    # the notification is delivered to the other workers on commit as well
+    session.info.setdefault('invalidated_users', set()).add(user_id)
+    await session.execute(select(func.pg_notify(USER_CACHE_CHANNEL, str(user_id))))
+
+
+def forget_cached_user(user_id: int):
+    _user_cache.invalidate(user_id)
+
+
+def clear_user_cache():
+    _user_cache.clear()
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_events(session: Session):
+    for user_id in session.info.pop('invalidated_users', ()):
+        _user_cache.invalidate(user_id)
+    if session.info.pop('invalidate_categories', False):
+        invalidate_category_cache()
+    events.publish(session.info.pop('events', []))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_events(session: Session):
+    session.info.pop('events', None)
+    session.info.pop('invalidated_users', None)
+    session.info.pop('invalidate_categories', None)
+    session.info.pop('after_commit', None)
+
+
+def _read_session_maker():
+    return replica_session_maker() or async_session_maker
+
+
+async def _read(query, session: AsyncSession | None = None):
+    # read-only queries go to a replica unless the request session already wrote something
+    replica_maker = replica_session_maker()
+    if replica_maker is not None and not (session is not None and session.info.get('has_writes')):
+        try:
+            async with replica_maker() as replica_session:
+                return await replica_session.execute(query)
+        except (OSError, asyncio.TimeoutError, exc.OperationalError, exc.InterfaceError, exc.TimeoutError):
+            logger.warning('Replica read failed, falling back to the primary', exc_info=True)
+    async with _session_scope(session) as session:
+        return await session.execute(query)
+
+
+@dataclass(frozen=True)
+class CatalogVersion:
+    version: int
+    updated_at: datetime.datetime
+
+
+# a sequence has no timestamp, so Last-Modified is when this process first saw the version;
+# that is never earlier than the change itself, so it can't produce a wrong 304
+_catalog_version: CatalogVersion | None = None
+
+
+def _catalog_changed(session: AsyncSession):
+    after_commit(session, 'catalog_version', _bump_catalog_version)
+
+
+_popularity_bumped_at = float('-inf')
+
+
+def _popularity_changed(session: AsyncSession):
+    # views arrive every few seconds; bumping the catalog for each flush would defeat the menu caches
+    global _popularity_bumped_at
+    if time.monotonic() - _popularity_bumped_at >= Settings.POPULARITY_CATALOG_SECONDS:
+        _popularity_bumped_at = time.monotonic()
+        _catalog_changed(session)
 
-from database import async_session_maker
-from models import Category, Recipe, User
+
+async def _bump_catalog_version():
+    # only after the commit, so the new version is never paired with the old data
+    try:
+        async with async_session_maker() as session:
+            await session.execute(select(catalog_version_seq.next_value()))
+    except (OSError, asyncio.TimeoutError, exc.OperationalError, exc.InterfaceError, exc.TimeoutError):
+        logger.warning('Failed to bump the catalog version, cached menus stay stale until the next write', exc_info=True)
+
+
+async def get_catalog_version(session: AsyncSession | None = None) -> CatalogVersion:
+    global _catalog_version
+    result = await _read(text('SELECT last_value FROM catalog_version_seq'), session)
+    version = result.scalar_one()
+    if _catalog_version is None or _catalog_version.version != version:
+        _catalog_version = CatalogVersion(version, datetime.datetime.utcnow())
+    return _catalog_version
+
+
+async def get_recipe_version(recipe_id: int, session: AsyncSession | None = None):
+    query = select(Recipe.version, Recipe.updated_at).where(Recipe.id == recipe_id)
+    result = await _read(query, session)
+    return result.one_or_none()
 
 
 async def create_user(
@@ -10,9 +189,10 @@ async def create_user(
         email: str,
         password: str,
         notes: str = '',
-        is_conflict: bool = False
+        is_conflict: bool = False,
+        session: AsyncSession | None = None
         ):
-    async with async_session_maker() as session:
+    async with _session_scope(session, commit=True) as session:
         query = insert(User).values(
             name=name,
             login=login,
@@ -22,23 +202,23 @@ async def create_user(
             is_conflict=is_conflict
             ).returning(User.id, User.login)
         data = await session.execute(query)
-        await session.commit()
         return data.fetchone()
 
 
-async def create_superuser_from_user(user_id: int):
-    async with async_session_maker() as session:
+async def create_superuser_from_user(user_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
         query = update(User).where(User.id == user_id).values(is_superuser=True)
         await session.execute(query)
-        await session.commit()
+        await _invalidate_user(session, user_id)
 
 
-async def create_category(name: str):
-    async with async_session_maker() as session:
+async def create_category(name: str, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
         query = insert(Category).values(name=name).returning(Category.id, Category.name)
         data = await session.execute(query)
-        await session.commit()
-        return data.fetchone()
+        _catalog_changed(session)
+        session.info['invalidate_categories'] = True
+    return data.fetchone()
 
 
 async def create_recipe(
@@ -47,9 +227,10 @@ async def create_recipe(
         recipe: str,
         image: str,
         creator_id: int,
-        categories: list = []
+        categories: list = [],
+        session: AsyncSession | None = None
         ):
-    async with async_session_maker() as session:
+    async with _session_scope(session, commit=True) as session:
         query = insert(Recipe).values(
             name=name,
             description=description,
@@ -59,7 +240,7 @@ async def create_recipe(
             creator_id=creator_id
             ).returning(Recipe.id, Recipe.name)
         data = await session.execute(query)
-        await session.commit()
+        _catalog_changed(session)
         return data.fetchone()
 
 
@@ -69,134 +250,431 @@ async def update_recipe(
         description: str,
         recipe: str,
         image: str = "",
-        categories: list = []
+        categories: list = [],
+        session: AsyncSession | None = None
         ):
-    async with async_session_maker() as session:
+    fields = {'name': name, 'description': description, 'recipe': recipe, 'image': image}
+    async with _session_scope(session, commit=True) as session:
+        # locked, so the event lists exactly the fields this update changed
+        query = select(Recipe.name, Recipe.description, Recipe.recipe, Recipe.image).where(Recipe.id == recipe_id).with_for_update()
+        old = (await session.execute(query)).one_or_none()
+        if old is None:
+            return
         query = update(Recipe).where(Recipe.id == recipe_id).values(
-            name=name,
-            description=description,
-            recipe=recipe,
-            image=image,
-            categories=categories
+            **fields,
+            categories=categories,
+            version=Recipe.version + 1,
+            updated_at=datetime.datetime.utcnow()
             )
         await session.execute(query)
-        await session.commit()
-
-
-async def get_user_by_id(user_id: int):
-    async with async_session_maker() as session:
-        query = select(User).filter_by(id=user_id)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
-
-
-async def get_user_by_login(user_login: str):
-    async with async_session_maker() as session:
+        _catalog_changed(session)
+        changed = {key: value for key, value in fields.items() if getattr(old, key) != value}
+        if changed:
+            _emit(session, {'type': 'updated', 'id': recipe_id, 'fields': changed})
+
+
+async def get_user_by_id(user_id: int, session: AsyncSession | None = None):
+    query = select(User).filter_by(id=user_id)
+    result = await _read(query, session)
+    return result.scalar_one_or_none()
+
+
+async def get_cached_user(user_id: int, session: AsyncSession | None = None) -> UserSnapshot | None:
+    if (user := _user_cache.get(user_id)) is not None:
+        return user
+    generation = _user_cache.generation
+    # from the primary, a lagging replica could put a row from before the invalidation back in the cache
+    async with _session_scope(session) as session:
+        db_user = (await session.execute(select(User).filter_by(id=user_id))).scalar_one_or_none()
+    if db_user is None:
+        return None
+    user = UserSnapshot(id=db_user.id, login=db_user.login, name=db_user.name, is_superuser=bool(db_user.is_superuser))
+    _user_cache.set(user_id, user, generation=generation)
+    return user
+
+
+async def get_user_by_login(user_login: str, session: AsyncSession | None = None):
+    async with _session_scope(session) as session:
         query = select(User).filter_by(login=user_login)
         result = await session.execute(query)
         return result.scalar_one_or_none()
 
 
-async def get_recipe_by_id(recipe_id: str):
-    async with async_session_maker() as session:
-        query = select(Recipe).filter_by(id=recipe_id)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
+async def get_recipe_by_id(recipe_id: str, session: AsyncSession | None = None):
+    query = select(Recipe).filter_by(id=recipe_id)
+    result = await _read(query, session)
+    return result.scalar_one_or_none()
 
 
-async def get_recipe_by_name(recipe_name: str):
-    async with async_session_maker() as session:
+async def get_recipe_by_name(recipe_name: str, session: AsyncSession | None = None):
+    async with _session_scope(session) as session:
         query = select(Recipe).filter_by(name=recipe_name)
         result = await session.execute(query)
         return result.scalar_one_or_none()
 
 
-async def get_category_by_id(category_id: str):
-    async with async_session_maker() as session:
-        query = select(Category).filter_by(id=category_id)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
+async def get_category_by_id(category_id: str, session: AsyncSession | None = None):
+    query = select(Category).filter_by(id=category_id)
+    result = await _read(query, session)
+    return result.scalar_one_or_none()
 
 
-async def save_recipe(recipe_id: int, saver_id: int):
-    async with async_session_maker() as session:
-        query = update(Recipe).where(Recipe.id == recipe_id).values(
-            saver_ids=text('array_append(saver_ids, :saver_id)')
-            )
-        await session.execute(query, {"saver_id": saver_id})
-        await session.commit()
+async def save_recipe(recipe_id: int, saver_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
+        query = pg_insert(RecipeSave).values(user_id=saver_id, recipe_id=recipe_id).on_conflict_do_nothing()
+        await session.execute(query)
 
 
-async def unsave_recipe(recipe_id: int, saver_id: int):
-    async with async_session_maker() as session:
-        query = update(Recipe).where(Recipe.id == recipe_id).values(
-            saver_ids=text('array_remove(saver_ids, :saver_id)')
-            )
-        await session.execute(query, {"saver_id": saver_id})
-        await session.commit()
+async def unsave_recipe(recipe_id: int, saver_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
+        query = delete(RecipeSave).where(RecipeSave.user_id == saver_id, RecipeSave.recipe_id == recipe_id)
+        await session.execute(query)
 
 
-async def update_user(user_id: int):
-    async with async_session_maker() as session:
+async def fetch_saved_recipe_ids(saver_id: int, recipe_ids: list, session: AsyncSession | None = None) -> set:
+    if not recipe_ids:
+        return set()
+    query = select(RecipeSave.recipe_id).where(RecipeSave.user_id == saver_id, RecipeSave.recipe_id.in_(recipe_ids))
+    result = await _read(query, session)
+    return set(result.scalars())
+
+
+async def create_refresh_token(token_id: str, user_id: int, expires_at, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
+        query = delete(RefreshToken).where(RefreshToken.user_id == user_id, RefreshToken.expires_at <= datetime.datetime.utcnow())
+        await session.execute(query)
+        query = insert(RefreshToken).values(id=token_id, user_id=user_id, expires_at=expires_at)
+        await session.execute(query)
+
+
+async def rotate_refresh_token(token_id: str, new_token_id: str, expires_at, session: AsyncSession | None = None):
+    # the old token expires REFRESH_TOKEN_GRACE_SECONDS after its first rotation, repeated rotations don't extend it
+    now = datetime.datetime.utcnow()
+    async with _session_scope(session, commit=True) as session:
+        query = update(RefreshToken).where(RefreshToken.id == token_id, RefreshToken.expires_at > now).values(
+            expires_at=func.least(RefreshToken.expires_at, now + datetime.timedelta(seconds=Settings.REFRESH_TOKEN_GRACE_SECONDS))
+            ).returning(RefreshToken.user_id)
+        user_id = (await session.execute(query)).scalar_one_or_none()
+        if user_id is None:
+            return None
+        query = delete(RefreshToken).where(RefreshToken.user_id == user_id, RefreshToken.expires_at <= now)
+        await session.execute(query)
+        query = insert(RefreshToken).values(id=new_token_id, user_id=user_id, expires_at=expires_at)
+        await session.execute(query)
+        return user_id
+
+
+async def delete_refresh_token(token_id: str, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
+        query = delete(RefreshToken).where(RefreshToken.id == token_id)
+        await session.execute(query)
+
+
+async def notify(channel: str, payload: str, session: AsyncSession | None = None):
+    # delivered to the listeners when the transaction commits
+    async with _session_scope(session, commit=True) as session:
+        await session.execute(select(func.pg_notify(channel, payload)))
+
+
+async def create_ws_message(body: str, session: AsyncSession | None = None) -> int:
+    async with _session_scope(session, commit=True) as session:
+        expired_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=Settings.WS_MESSAGE_TTL_SECONDS)
+        await session.execute(delete(WsMessage).where(WsMessage.created_at < expired_before))
+        query = insert(WsMessage).values(body=body).returning(WsMessage.id)
+        return (await session.execute(query)).scalar_one()
+
+
+async def next_ws_message_seqs(count: int, session: AsyncSession | None = None) -> list[int]:
+    async with _session_scope(session, commit=True) as session:
+        query = select(ws_message_seq.next_value()).select_from(func.generate_series(1, count))
+        return sorted((await session.execute(query)).scalars())
+
+
+async def get_ws_message(message_id: int, session: AsyncSession | None = None) -> str | None:
+    # read from the primary, a replica may not have the row yet when the notification arrives
+    async with _session_scope(session) as session:
+        query = select(WsMessage.body).where(WsMessage.id == message_id)
+        return (await session.execute(query)).scalar_one_or_none()
+
+
+async def update_user(user_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
         query = update(User).where(User.id == user_id).values(name="222")
         await session.execute(query)
-        await session.commit()
+        await _invalidate_user(session, user_id)
 
 
-async def increase_recipe_popularity(recipe_id: int):
-    async with async_session_maker() as session:
-        popularity = (await get_recipe_by_id(recipe_id)).popularity
+async def increase_recipe_popularity(recipe_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
         query = update(Recipe).where(Recipe.id == recipe_id).values(
-            popularity=(popularity if popularity else 0) + 1
+            popularity=Recipe.popularity + 1,
+            version=Recipe.version + 1,
+            updated_at=datetime.datetime.utcnow()
+            ).returning(Recipe.popularity)
+        popularity = (await session.execute(query)).scalar_one_or_none()
+        if popularity is not None:
+            _popularity_changed(session)
+            _emit(session, {'type': 'popularity', 'id': recipe_id, 'popularity': popularity})
+
+
+async def increase_recipes_popularity(views: dict[int, int], session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
+        query = text(
+            'UPDATE recipe SET popularity = recipe.popularity + views.count, '
+            "version = recipe.version + 1, updated_at = timezone('utc', now()) "
+            'FROM unnest(:recipe_ids, :counts) AS views(id, count) '
+            'WHERE recipe.id = views.id '
+            'RETURNING recipe.id, recipe.popularity'
+            ).bindparams(
+                bindparam('recipe_ids', type_=ARRAY(Integer)),
+                bindparam('counts', type_=ARRAY(Integer))
             )
-        await session.execute(query)
-        await session.commit()
+        result = await session.execute(query, {"recipe_ids": list(views.keys()), "counts": list(views.values())})
+        for recipe_id, popularity in result:
+            _emit(session, {'type': 'popularity', 'id': recipe_id, 'popularity': popularity})
+        _popularity_changed(session)
 
 
-async def fetch_users(skip: int = 0, limit: int = 10):
-    async with async_session_maker() as session:
-        query = select(User).offset(skip).limit(limit)
-        result = await session.execute(query)
-        return list(result)
+async def fetch_users(skip: int = 0, limit: int = 10, session: AsyncSession | None = None):
+    query = select(User).offset(skip).limit(limit)
+    result = await _read(query, session)
+    return list(result)
 
 
-async def get_user_by_email(email: str):
-    async with async_session_maker() as session:
+async def get_user_by_email(email: str, session: AsyncSession | None = None):
+    async with _session_scope(session) as session:
         query = select(User).filter_by(email=email)
         result = await session.execute(query)
         return result.scalar_one_or_none()
 
 
-async def fetch_recipes():
-    async with async_session_maker() as session:
-        query = select(Recipe)
-        result = await session.execute(query)
-        return list(result)
+async def fetch_recipes(session: AsyncSession | None = None):
+    query = select(Recipe)
+    result = await _read(query, session)
+    return list(result)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _has_dish_name(dish_name: str) -> bool:
+    return bool(re.sub(r"\s+", '', dish_name))
+
+
+def _menu_filters(sort: str = "", dish_name: str = "", categories: list = [], saver_id: int | None = None) -> list:
+    filters = []
+    if saver_id is not None:
+        filters.append(
+            select(RecipeSave.recipe_id)
+            .where(RecipeSave.user_id == saver_id, RecipeSave.recipe_id == Recipe.id)
+            .exists()
+        )
+    if categories:
+        # array containment (<@) so the GIN index on categories is used
+        filters.append(func.cardinality(Recipe.categories) > 0)
+        filters.append(Recipe.categories.contained_by(categories))
+    if _has_dish_name(dish_name):
+        # both conditions are served by the ix_recipe_name_trgm index
+        name_filter = Recipe.name.ilike(f'%{_escape_like(dish_name)}%', escape='\\')
+        if sort == "relevance":
+            name_filter = or_(name_filter, Recipe.name.op('%')(dish_name))
+        filters.append(name_filter)
+    return filters
+
+
+def _menu_sort_keys(sort: str = "", dish_name: str = "") -> tuple[list, bool]:
+    if sort == "relevance" and _has_dish_name(dish_name):
+        return [func.similarity(Recipe.name, dish_name), Recipe.id], True
+    if sort == "popularity-asc":
+        return [Recipe.popularity, Recipe.id], False
+    if sort == "popularity-desc":
+        return [Recipe.popularity, Recipe.id], True
+    if sort == "a-z":
+        return [func.lower(Recipe.name), Recipe.id], False
+    if sort == "z-a":
+        return [func.lower(Recipe.name), Recipe.id], True
+    return [Recipe.id], False
+
+
+def _encode_cursor(sort: str, values) -> str:
+    payload = json.dumps({'s': sort, 'k': list(values)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str, sort: str, keys_count: int) -> list:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = payload['k']
+        cursor_sort = payload['s']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ValueError('Malformed cursor.')
+    if cursor_sort != sort or not isinstance(values, list) or len(values) != keys_count:
+        raise ValueError('Cursor does not match the requested sort.')
+    # the values are compared with the sort keys in SQL, a wrong type would fail there instead of here
+    types = [{'relevance': (int, float), 'a-z': str, 'z-a': str}.get(sort, int), int][-keys_count:]
+    if any(isinstance(value, bool) or not isinstance(value, type_) for value, type_ in zip(values, types)):
+        raise ValueError('Malformed cursor.')
+    return values
+
+
+async def fetch_menu(
+        sort: str = "",
+        dish_name: str = "",
+        categories: list = [],
+        page: int = 0,
+        saver_id: int | None = None,
+        after: str | None = None,
+        session: AsyncSession | None = None
+        ):
+    filters = _menu_filters(sort=sort, dish_name=dish_name, categories=categories, saver_id=saver_id)
+    keys, descending = _menu_sort_keys(sort, dish_name)
+    query = select(Recipe, *keys).where(*filters)\
+        .order_by(*[key.desc() if descending else key.asc() for key in keys])\
+        .limit(Settings.NUM_RECIPES_ON_PAGE + 1)
+
+    if after:
+        # keyset mode: seek past the cursor row through the sort index, no offset and no count
+        values = _decode_cursor(after, sort, len(keys))
+        position = tuple_(*keys) < tuple_(*values) if descending else tuple_(*keys) > tuple_(*values)
+        query = query.where(position)
+    else:
+        query = query.offset(max(page, 0) * Settings.NUM_RECIPES_ON_PAGE)
+
+    rows = list(await _read(query, session))
+
+    total = None
+    if not after:
+        count_query = select(func.count()).select_from(Recipe).where(*filters)
+        total = (await _read(count_query, session)).scalar_one()
+
+    recipes = rows[:Settings.NUM_RECIPES_ON_PAGE]
+    next_cursor = None
+    if len(rows) > Settings.NUM_RECIPES_ON_PAGE:
+        next_cursor = _encode_cursor(sort, recipes[-1][1:])
+    return MenuPage(recipes=recipes, total=total, next_cursor=next_cursor)
+
+
+async def fetch_saved_recipes(saver_id: int, session: AsyncSession | None = None):
+    query = select(Recipe).join(RecipeSave, RecipeSave.recipe_id == Recipe.id).filter(RecipeSave.user_id == saver_id)
+    result = await _read(query, session)
+    return list(result)
+
+
+async def _load_categories(session: AsyncSession | None = None, catalog_version: int | None = None) -> _CategoryCache:
+    # pages cached under a catalog version pass it, so they are never rendered with categories older than it
+    global _category_cache
+    if (
+        _category_cache is None
+        or _category_cache.expires_at <= time.monotonic()
+        or (catalog_version is not None and catalog_version > _category_cache.catalog_version)
+    ):
+        generation = _category_generation
+        if catalog_version is None:
+            catalog_version = (await get_catalog_version(session)).version
+        query = select(Category)
+        result = await _read(query, session)
+        categories = sorted(result, key=lambda category: category[0].id)
+        loaded = _CategoryCache(
+            categories=categories,
+            names={category[0].id: category[0].name for category in categories},
+            expires_at=time.monotonic() + Settings.CATEGORY_CACHE_SECONDS,
+            catalog_version=catalog_version
+            )
+        if generation != _category_generation:
+            return loaded
+        _category_cache = loaded
+    return _category_cache
 
 
-async def fetch_saved_recipes(saver_id: int):
-    async with async_session_maker() as session:
-        query = select(Recipe).filter(Recipe.saver_ids.any(saver_id))
-        result = await session.execute(query)
-        return list(result)
+def invalidate_category_cache():
+    global _category_cache, _category_generation
+    _category_generation += 1
+    _category_cache = None
 
 
-async def fetch_categories():
-    async with async_session_maker() as session:
-        query = select(Category)
-        result = await session.execute(query)
-        return sorted(result, key=lambda category: category[0].id)
+async def fetch_categories(session: AsyncSession | None = None, catalog_version: int | None = None):
+    return (await _load_categories(session, catalog_version)).categories
 
 
-async def delete_user(user_id: int):
-    async with async_session_maker() as session:
+async def fetch_category_names(session: AsyncSession | None = None, catalog_version: int | None = None) -> dict:
+    return (await _load_categories(session, catalog_version)).names
+
+
+async def delete_user(user_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
         query = delete(User).where(User.id == user_id)
         await session.execute(query)
-        await session.commit()
+        await _invalidate_user(session, user_id)
 
 
-async def delete_recipe(recipe_id: int):
-    async with async_session_maker() as session:
+async def delete_recipe(recipe_id: int, session: AsyncSession | None = None):
+    async with _session_scope(session, commit=True) as session:
         query = delete(Recipe).where(Recipe.id == recipe_id)
-        await session.execute(query)
-        await session.commit()
+        result = await session.execute(query)
+        _catalog_changed(session)
+        if result.rowcount:
+            _emit(session, {'type': 'deleted', 'id': recipe_id})
+
+
+async def copy_recipes(records, creator_id: int, session: AsyncSession | None = None) -> tuple[int, list]:
+    # records yield (line, name, description, recipe, image, categories) and are streamed with COPY
+    async with _session_scope(session, commit=True) as session:
+        await session.execute(text(
+            'CREATE TEMPORARY TABLE recipe_import '
+            '(line integer, name varchar, description varchar, recipe varchar, image varchar, categories integer[]) '
+            'ON COMMIT DROP'
+            ))
+        connection = await (await session.connection()).get_raw_connection()
+        await connection.driver_connection.copy_records_to_table(
+            'recipe_import',
+            records=records,
+            columns=['line', 'name', 'description', 'recipe', 'image', 'categories']
+            )
+
+        # rows whose name is taken, either by an existing recipe or by an earlier line of the import
+        result = await session.execute(text(
+            'SELECT line, CASE WHEN EXISTS (SELECT 1 FROM recipe WHERE recipe.name = staged.name) '
+            "THEN 'Recipe ' || name || ' already exists.' "
+            "ELSE 'Recipe ' || name || ' is duplicated in the import.' END "
+            'FROM (SELECT line, name, row_number() OVER (PARTITION BY name ORDER BY line) AS position FROM recipe_import) AS staged '
+            'WHERE position > 1 OR EXISTS (SELECT 1 FROM recipe WHERE recipe.name = staged.name) '
+            'ORDER BY line'
+            ))
+        errors = [tuple(row) for row in result]
+
+        result = await session.execute(text(
+            'INSERT INTO recipe (name, description, recipe, image, categories, creator_id, popularity, created_at, updated_at) '
+            "SELECT DISTINCT ON (name) name, description, recipe, image, categories, :creator_id, 0, "
+            "timezone('utc', now()), timezone('utc', now()) "
+            'FROM recipe_import ORDER BY name, line '
+            'ON CONFLICT (name) DO NOTHING'
+            ), {"creator_id": creator_id})
+        await session.execute(text('DROP TABLE recipe_import'))
+        if result.rowcount:
+            _catalog_changed(session)
+        return result.rowcount, errors
+
+
+async def stream_recipes(categories: list = [], creator_id: int | None = None, after_id: int = 0):
+    # server-side cursor over plain rows (no ORM identity map), fetched EXPORT_BATCH_SIZE at a time
+    query = select(*Recipe.__table__.c).where(Recipe.id > after_id).order_by(Recipe.id)\
+        .execution_options(yield_per=Settings.EXPORT_BATCH_SIZE)
+    if categories:
+        query = query.where(Recipe.categories.contains(categories))
+    if creator_id is not None:
+        query = query.where(Recipe.creator_id == creator_id)
+    async with _read_session_maker()() as session:
+        result = await session.stream(query)
+        async for row in result.mappings():
+            yield row
+
+
+async def stream_users(after_id: int = 0):
+    query = select(User.id, User.name, User.login, User.email, User.is_superuser, User.notes, User.created_at)\
+        .where(User.id > after_id).order_by(User.id)\
+        .execution_options(yield_per=Settings.EXPORT_BATCH_SIZE)
+    async with _read_session_maker()() as session:
+        result = await session.stream(query)
+        async for row in result.mappings():
+            yield row
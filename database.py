@@ -1,6 +1,12 @@
+import itertools
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
                                     create_async_engine)
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from settings import Settings
 
@@ -8,9 +14,108 @@ from settings import Settings
 DATABASE_URL = f'postgresql+asyncpg://{Settings.DATABASE_USER}:{Settings.DATABASE_PASSWORD}@' \
                f'{Settings.DATABASE_HOST}:{Settings.DATABASE_PORT}/{Settings.DATABASE_NAME}'
 
-engine = create_async_engine(DATABASE_URL)
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    max_overflow_used: int = 0
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # QueuePool that records how long checkouts wait for a connection
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        wait = time.perf_counter() - started
+        self.stats.checkouts += 1
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        self.stats.max_overflow_used = max(self.stats.max_overflow_used, self.overflow())
+        return connection
+
+
+def create_engine(url: str):
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_size=Settings.DATABASE_POOL_SIZE,
+        max_overflow=Settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=Settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=Settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=Settings.DATABASE_POOL_PRE_PING,
+        connect_args={
+            'statement_cache_size': Settings.DATABASE_STATEMENT_CACHE_SIZE,
+            'prepared_statement_cache_size': Settings.DATABASE_STATEMENT_CACHE_SIZE,
+        },
+    )
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    stats = pool.stats
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'idle': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': Settings.DATABASE_MAX_OVERFLOW,
+        'max_overflow_used': max(stats.max_overflow_used, 0),
+        'checkouts': stats.checkouts,
+        'timeouts': stats.timeouts,
+        'avg_wait_ms': stats.total_wait / stats.checkouts * 1000 if stats.checkouts else 0.0,
+        'max_wait_ms': stats.max_wait * 1000,
+    }
+
+
+engine = create_engine(DATABASE_URL)
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+replica_engines = [create_engine(url) for url in Settings.DATABASE_REPLICA_URLS]
+replica_session_makers = [
+    async_sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+    for replica_engine in replica_engines
+]
+_replica_cycle = itertools.cycle(replica_session_makers)
+
+
+def replica_session_maker():
+    # round-robin over the configured replicas, None when there are none
+    return next(_replica_cycle) if replica_session_makers else None
+
 
 class Base(DeclarativeBase):
     pass
+
+
+def after_commit(session: AsyncSession, key: str, callback):
+    # async callback run once the session commits; registering the same key twice runs it once
+    session.info.setdefault('after_commit', {})[key] = callback
+
+
+async def run_after_commit(session: AsyncSession):
+    for callback in session.info.pop('after_commit', {}).values():
+        await callback()
+
+
+async def get_session():
+    # one session (and one pooled connection) per request, committed when the request succeeds
+    async with async_session_maker() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+        await run_after_commit(session)
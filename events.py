@@ -0,0 +1,24 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# called with the list of events of every committed transaction
+_listeners: list = []
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+def publish(events: list[dict]):
+    if not events:
+        return
+    for listener in list(_listeners):
+        try:
+            listener(events)
+        except Exception:
+            logger.exception('Event listener %r failed', listener)
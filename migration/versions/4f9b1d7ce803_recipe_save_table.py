@@ -0,0 +1,55 @@
+"""recipe save table
+
+Revision ID: 4f9b1d7ce803
+Revises: e3a8c6145f70
+Create Date: 2026-10-18 13:25:09.118457
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '4f9b1d7ce803'
+down_revision: Union[str, None] = 'e3a8c6145f70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'recipe_save',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipe.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'recipe_id')
+    )
+    op.create_index('ix_recipe_save_recipe_id_user_id', 'recipe_save', ['recipe_id', 'user_id'], unique=False)
+
+    # saver_ids may hold duplicates and ids of deleted users
+    op.execute(
+        'INSERT INTO recipe_save (user_id, recipe_id, created_at) '
+        'SELECT DISTINCT saves.user_id, recipe.id, timezone(\'utc\', now()) '
+        'FROM recipe CROSS JOIN LATERAL unnest(recipe.saver_ids) AS saves(user_id) '
+        'JOIN "user" ON "user".id = saves.user_id'
+    )
+
+    op.drop_index('ix_recipe_saver_ids', table_name='recipe')
+    op.drop_column('recipe', 'saver_ids')
+
+
+def downgrade() -> None:
+    op.add_column('recipe', sa.Column('saver_ids', sa.ARRAY(sa.Integer()), nullable=True))
+    op.execute(
+        'UPDATE recipe SET saver_ids = saves.user_ids '
+        'FROM (SELECT recipe_id, array_agg(user_id ORDER BY created_at) AS user_ids '
+        'FROM recipe_save GROUP BY recipe_id) AS saves '
+        'WHERE recipe.id = saves.recipe_id'
+    )
+    op.create_index('ix_recipe_saver_ids', 'recipe', ['saver_ids'], unique=False, postgresql_using='gin')
+
+    op.drop_index('ix_recipe_save_recipe_id_user_id', table_name='recipe_save')
+    op.drop_table('recipe_save')
@@ -0,0 +1,33 @@
+"""ws message
+
+Revision ID: 5e0c7b93a2d1
+Revises: d17f3a8e5c62
+Create Date: 2026-10-18 18:12:44.215309
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0c7b93a2d1'
+down_revision: Union[str, None] = 'd17f3a8e5c62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ws_message',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('body', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_ws_message_created_at'), 'ws_message', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_ws_message_created_at'), table_name='ws_message')
+    op.drop_table('ws_message')
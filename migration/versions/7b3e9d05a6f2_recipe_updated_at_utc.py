@@ -0,0 +1,27 @@
+"""recipe updated_at utc
+
+Revision ID: 7b3e9d05a6f2
+Revises: c4d82f1e6a37
+Create Date: 2026-10-18 23:04:51.728310
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e9d05a6f2'
+down_revision: Union[str, None] = 'c4d82f1e6a37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('recipe', 'updated_at', server_default=sa.text("timezone('utc', now())"))
+    # rows never updated since they were created got the default in the database's local time
+    op.execute('UPDATE recipe SET updated_at = created_at WHERE version = 1')
+
+
+def downgrade() -> None:
+    op.alter_column('recipe', 'updated_at', server_default=sa.text('now()'))
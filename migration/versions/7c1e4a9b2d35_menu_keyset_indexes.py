@@ -0,0 +1,30 @@
+"""menu keyset indexes
+
+Revision ID: 7c1e4a9b2d35
+Revises: 43600d656533
+Create Date: 2026-10-18 10:12:41.385102
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e4a9b2d35'
+down_revision: Union[str, None] = '43600d656533'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('UPDATE recipe SET popularity = 0 WHERE popularity IS NULL')
+    op.alter_column('recipe', 'popularity', existing_type=sa.Integer(), server_default='0', nullable=False)
+    op.create_index('ix_recipe_popularity_id', 'recipe', ['popularity', 'id'], unique=False)
+    op.create_index('ix_recipe_lower_name_id', 'recipe', [sa.text('lower(name)'), 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_lower_name_id', table_name='recipe')
+    op.drop_index('ix_recipe_popularity_id', table_name='recipe')
+    op.alter_column('recipe', 'popularity', existing_type=sa.Integer(), server_default=None, nullable=True)
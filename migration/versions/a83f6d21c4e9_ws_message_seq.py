@@ -0,0 +1,25 @@
+"""ws message seq
+
+Revision ID: a83f6d21c4e9
+Revises: 5e0c7b93a2d1
+Create Date: 2026-10-18 19:03:17.508126
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a83f6d21c4e9'
+down_revision: Union[str, None] = '5e0c7b93a2d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('ws_message_seq')))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('ws_message_seq')))
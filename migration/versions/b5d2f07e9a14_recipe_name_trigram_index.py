@@ -0,0 +1,32 @@
+"""recipe name trigram index
+
+Revision ID: b5d2f07e9a14
+Revises: 7c1e4a9b2d35
+Create Date: 2026-10-18 11:02:17.504630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d2f07e9a14'
+down_revision: Union[str, None] = '7c1e4a9b2d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_recipe_name_trgm',
+        'recipe',
+        ['name'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'name': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_name_trgm', table_name='recipe')
@@ -0,0 +1,38 @@
+"""catalog version seq
+
+Revision ID: c4d82f1e6a37
+Revises: a83f6d21c4e9
+Create Date: 2026-10-18 21:12:40.316842
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d82f1e6a37'
+down_revision: Union[str, None] = 'a83f6d21c4e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('catalog_version_seq')))
+    op.execute("SELECT setval('catalog_version_seq', (SELECT version FROM catalog_version WHERE id = 1))")
+    op.drop_table('catalog_version')
+
+
+def downgrade() -> None:
+    op.create_table(
+        'catalog_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO catalog_version (id, version, updated_at) "
+        "SELECT 1, last_value, timezone('utc', now()) FROM catalog_version_seq"
+        )
+    op.execute(sa.schema.DropSequence(sa.Sequence('catalog_version_seq')))
@@ -0,0 +1,38 @@
+"""content versions
+
+Revision ID: d17f3a8e5c62
+Revises: 9a6e2c4b7f18
+Create Date: 2026-10-18 18:05:51.240367
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd17f3a8e5c62'
+down_revision: Union[str, None] = '9a6e2c4b7f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('recipe', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('recipe', sa.Column('updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"), nullable=False))
+    op.execute('UPDATE recipe SET updated_at = created_at')
+
+    op.create_table(
+        'catalog_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 1, timezone('utc', now()))")
+
+
+def downgrade() -> None:
+    op.drop_table('catalog_version')
+    op.drop_column('recipe', 'updated_at')
+    op.drop_column('recipe', 'version')
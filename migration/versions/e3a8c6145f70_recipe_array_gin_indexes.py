@@ -0,0 +1,26 @@
+"""recipe array gin indexes
+
+Revision ID: e3a8c6145f70
+Revises: b5d2f07e9a14
+Create Date: 2026-10-18 11:47:53.921846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3a8c6145f70'
+down_revision: Union[str, None] = 'b5d2f07e9a14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_recipe_categories', 'recipe', ['categories'], unique=False, postgresql_using='gin')
+    op.create_index('ix_recipe_saver_ids', 'recipe', ['saver_ids'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recipe_saver_ids', table_name='recipe')
+    op.drop_index('ix_recipe_categories', table_name='recipe')
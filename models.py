@@ -1,6 +1,8 @@
 import datetime
 
-from sqlalchemy import ARRAY, Boolean, Column, DateTime, Integer, String
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        Sequence, String, func, text)
+from sqlalchemy.dialects.postgresql import ARRAY
 
 from database import Base
 
@@ -36,8 +38,20 @@ class Recipe(Base):
     id = Column(Integer, primary_key=True)
     categories = Column(ARRAY(Integer))
     created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
-    popularity = Column(Integer, default=0)
-    saver_ids = Column(ARRAY(Integer), default=[])
+    popularity = Column(Integer, default=0, server_default='0', nullable=False)
+    # bumped on every change of the row, used for ETag / Last-Modified
+    version = Column(Integer, default=1, server_default='1', nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, server_default=text("timezone('utc', now())"), nullable=False)
+
+    __table_args__ = (
+        # keyset pagination indexes, one per menu sort (see dao.fetch_menu)
+        Index('ix_recipe_popularity_id', popularity, id),
+        Index('ix_recipe_lower_name_id', func.lower(name), id),
+        # dish name search (ILIKE and pg_trgm similarity)
+        Index('ix_recipe_name_trgm', name, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # category (<@) containment filter
+        Index('ix_recipe_categories', categories, postgresql_using='gin'),
+    )
 
     def __repr__(self):
         return f'Recipe {self.name} {self.id}'
@@ -51,3 +65,52 @@ class Category(Base):
 
     def __repr__(self):
         return f'Category {self.name} {self.id}'
+
+
+# bumped after every committed change to recipes or categories shown in the menu;
+# a sequence rather than a row, so concurrent writers never wait on each other
+catalog_version_seq = Sequence('catalog_version_seq', metadata=Base.metadata)
+
+
+class RecipeSave(Base):
+    __tablename__ = "recipe_save"
+
+    user_id = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    recipe_id = Column(Integer, ForeignKey('recipe.id', ondelete='CASCADE'), primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index('ix_recipe_save_recipe_id_user_id', recipe_id, user_id),
+    )
+
+    def __repr__(self):
+        return f'RecipeSave {self.user_id} {self.recipe_id}'
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_token"
+
+    # sha256 of the token handed to the client, the token itself is never stored
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'RefreshToken {self.user_id} {self.expires_at}'
+
+
+# sequence numbers of websocket messages, shared by all workers
+ws_message_seq = Sequence('ws_message_seq', metadata=Base.metadata)
+
+
+class WsMessage(Base):
+    __tablename__ = "ws_message"
+
+    # websocket payloads too large for a NOTIFY, read back by every worker and pruned after a while
+    id = Column(Integer, primary_key=True)
+    body = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'WsMessage {self.id}'
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import re
+from dataclasses import dataclass, field
+
+import dao
+
+FORMATS = ('ndjson', 'csv')
+# recipe.categories is an integer[], a value outside it would fail the whole COPY
+MIN_CATEGORY_ID, MAX_CATEGORY_ID = -2 ** 31, 2 ** 31 - 1
+CATEGORY_ID_PATTERN = re.compile(r'-?\d+')
+# the csv module's default of 131072 characters is less than a long recipe body
+MAX_CSV_FIELD_SIZE = 16 * 1024 * 1024
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    errors: list = field(default_factory=list)
+
+
+def _validate(line: int, data) -> tuple:
+    if not isinstance(data, dict):
+        raise ValueError('Row must be an object.')
+    for key in ('name', 'description', 'recipe'):
+        if not isinstance(data.get(key), str) or not data[key].strip():
+            raise ValueError(f'Field {key} is required.')
+    image = data.get('image') or ''
+    if not isinstance(image, str):
+        raise ValueError('Field image must be a string.')
+    for key, value in (('name', data['name']), ('description', data['description']), ('recipe', data['recipe']), ('image', image)):
+        # postgres text can't hold NUL characters
+        if '\x00' in value:
+            raise ValueError(f'Field {key} must not contain NUL characters.')
+    categories = data.get('categories') or []
+    if isinstance(categories, str):
+        # CSV cells, ids separated by ';' or spaces
+        categories = categories.replace(';', ' ').split()
+        if not all(CATEGORY_ID_PATTERN.fullmatch(category) for category in categories):
+            raise ValueError('Field categories must be a list of category ids.')
+        categories = [int(category) for category in categories]
+    elif not isinstance(categories, list) or any(type(category) is not int for category in categories):
+        raise ValueError('Field categories must be a list of category ids.')
+    if any(not MIN_CATEGORY_ID <= category <= MAX_CATEGORY_ID for category in categories):
+        raise ValueError('Field categories has an id out of range.')
+    return line, data['name'], data['description'], data['recipe'], image, categories
+
+
+def _csv_rows(text_file, report: ImportReport):
+    csv.field_size_limit(MAX_CSV_FIELD_SIZE)
+    reader = csv.DictReader(text_file)
+    while True:
+        try:
+            data = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # the reader starts over on the next line, so only this row is lost;
+            # DictReader.line_num is only updated for rows that parse
+            report.errors.append((reader.reader.line_num, str(e)))
+            continue
+        yield reader.line_num, data
+
+
+def parse_recipes(text_file, file_format: str, report: ImportReport):
+    # yields valid COPY records and collects the per-row errors in the report
+    if file_format == 'csv':
+        rows = _csv_rows(text_file, report)
+    else:
+        rows = enumerate(text_file, start=1)
+
+    for line, row in rows:
+        try:
+            if file_format == 'ndjson':
+                if not row.strip():
+                    continue
+                row = json.loads(row)
+            yield _validate(line, row)
+        except ValueError as e:
+            report.errors.append((line, str(e)))
+
+
+async def import_recipes(binary_file, file_format: str, creator_id: int, session=None) -> ImportReport:
+    if file_format not in FORMATS:
+        raise ValueError(f'Unsupported format {file_format}, expected one of: {", ".join(FORMATS)}.')
+    report = ImportReport()
+    text_file = io.TextIOWrapper(binary_file, encoding='utf-8', errors='replace', newline='')
+    try:
+        records = parse_recipes(text_file, file_format, report)
+        report.imported, conflicts = await dao.copy_recipes(records, creator_id=creator_id, session=session)
+    finally:
+        text_file.detach()
+    report.errors = sorted(report.errors + conflicts)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import recipes from an NDJSON or CSV file.')
+    parser.add_argument('path')
+    parser.add_argument('--creator-id', type=int, required=True)
+    parser.add_argument('--format', choices=FORMATS, help='defaults to the file extension')
+    args = parser.parse_args()
+
+    file_format = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+    with open(args.path, 'rb') as binary_file:
+        report = asyncio.run(import_recipes(binary_file, file_format, creator_id=args.creator_id))
+
+    for line, error in report.errors:
+        print(f'line {line}: {error}')
+    print(f'Imported {report.imported} recipes, {len(report.errors)} rows failed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, insert, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import dao
+from database import DATABASE_URL
+from models import Recipe, RecipeSave, User
+
+# needs a migrated database (alembic upgrade head); everything seeded here is rolled back
+NUM_RECIPES = 2000
+
+
+async def _explain(queries: list) -> list[str] | None:
+    # None when the database isn't migrated; any other SQL error is the test failing
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        async with engine.connect() as connection:
+            migrated = (await connection.execute(text("SELECT to_regclass('recipe_save') IS NOT NULL"))).scalar_one()
+            await connection.rollback()
+            if not migrated:
+                return None
+            transaction = await connection.begin()
+            try:
+                user_id = (await connection.execute(
+                    insert(User).values(name='explain', login='explain-test', email='explain@test', password='-').returning(User.id)
+                    )).scalar_one()
+                await connection.execute(insert(Recipe), [{
+                    'name': f'explain recipe {i}',
+                    'description': '-',
+                    'recipe': '-',
+                    'creator_id': user_id,
+                    'categories': [i % 50, (i * 7) % 50],
+                } for i in range(NUM_RECIPES)])
+                recipe_ids = (await connection.execute(select(Recipe.id).limit(100))).scalars().all()
+                await connection.execute(insert(RecipeSave), [{'user_id': user_id, 'recipe_id': id} for id in recipe_ids])
+                await connection.execute(text('ANALYZE recipe'))
+                await connection.execute(text('ANALYZE recipe_save'))
+                # a seeded table this small would otherwise be read sequentially whatever the indexes
+                await connection.execute(text('SET LOCAL enable_seqscan = off'))
+
+                plans = []
+                for query in queries:
+                    query = query(user_id)
+                    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+                    rows = await connection.execute(text(f'EXPLAIN {sql}'))
+                    plans.append('\n'.join(row[0] for row in rows))
+                return plans
+            finally:
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+
+
+def _explain_or_skip(*queries) -> list[str]:
+    try:
+        plans = asyncio.run(_explain(list(queries)))
+    except (OSError, asyncio.TimeoutError, exc.OperationalError, exc.InterfaceError) as e:
+        pytest.skip(f'no database available: {e}')
+    if plans is None:
+        pytest.skip('the database is not migrated')
+    return plans
+
+
+def test_category_filter_uses_gin_index():
+    plan, = _explain_or_skip(lambda user_id: select(Recipe.id).where(*dao._menu_filters(categories=[1, 2])))
+    assert 'ix_recipe_categories' in plan
+
+
+def test_saved_filter_uses_recipe_save_index():
+    plan, = _explain_or_skip(lambda user_id: select(Recipe.id).where(*dao._menu_filters(saver_id=user_id)))
+    assert 'recipe_save_pkey' in plan or 'ix_recipe_save_recipe_id_user_id' in plan
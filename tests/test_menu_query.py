@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+import dao
+from models import Recipe
+
+
+def _compile(query) -> str:
+    return str(query.compile(dialect=postgresql.dialect()))
+
+
+def test_category_filter_uses_array_containment():
+    sql = _compile(select(Recipe.id).where(*dao._menu_filters(categories=[1, 2])))
+    assert 'recipe.categories <@' in sql
+    assert 'cardinality(recipe.categories) >' in sql
+
+
+def test_saved_filter_uses_recipe_save():
+    sql = _compile(select(Recipe.id).where(*dao._menu_filters(saver_id=7)))
+    assert 'EXISTS' in sql and 'recipe_save.user_id' in sql
+
+
+def test_name_filter_escapes_like_wildcards():
+    sql = _compile(select(Recipe.id).where(*dao._menu_filters(dish_name='50%_off')))
+    assert 'ILIKE' in sql
+    assert dao._escape_like('50%_off') == '50\\%\\_off'
+
+
+def test_export_category_filter_uses_array_containment():
+    assert '@>' in _compile(select(Recipe.id).where(Recipe.categories.contains([1, 2])))
+
+
+def test_cursor_values_must_match_the_sort_key_types():
+    assert dao._decode_cursor(dao._encode_cursor('popularity-desc', [3, 1]), 'popularity-desc', 2) == [3, 1]
+    assert dao._decode_cursor(dao._encode_cursor('a-z', ['soup', 1]), 'a-z', 2) == ['soup', 1]
+    for sort, values in (('popularity-desc', ['x', 1]), ('a-z', [1, 1]), ('', [True]), ('relevance', [0.5, None])):
+        with pytest.raises(ValueError):
+            dao._decode_cursor(dao._encode_cursor(sort, values), sort, len(values))
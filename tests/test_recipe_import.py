@@ -0,0 +1,39 @@
+import io
+
+import recipe_import
+
+
+def _parse(text: str, file_format: str = 'ndjson') -> tuple[list, recipe_import.ImportReport]:
+    report = recipe_import.ImportReport()
+    records = list(recipe_import.parse_recipes(io.StringIO(text), file_format, report))
+    return records, report
+
+
+def test_rows_copy_would_reject_fail_on_their_own():
+    records, report = _parse(
+        '{"name": "ok", "description": "d", "recipe": "r", "categories": [1, 2]}\n'
+        '{"name": "big", "description": "d", "recipe": "r", "categories": [2147483648]}\n'
+        '{"name": "nul\\u0000", "description": "d", "recipe": "r"}\n'
+        '{"name": "nul image", "description": "d", "recipe": "r", "image": "a\\u0000"}\n'
+        )
+    assert [record[1] for record in records] == ['ok']
+    assert [line for line, _ in report.errors] == [2, 3, 4]
+
+
+def test_category_ids_must_be_integers():
+    records, report = _parse(
+        '{"name": "ok", "description": "d", "recipe": "r", "categories": "1;2"}\n'
+        '{"name": "bool", "description": "d", "recipe": "r", "categories": [true]}\n'
+        '{"name": "float", "description": "d", "recipe": "r", "categories": [1.9]}\n'
+        '{"name": "dict", "description": "d", "recipe": "r", "categories": {"1": 2}}\n'
+        '{"name": "word", "description": "d", "recipe": "r", "categories": "1;x"}\n'
+        )
+    assert [record[5] for record in records] == [[1, 2]]
+    assert [line for line, _ in report.errors] == [2, 3, 4, 5]
+
+
+def test_csv_errors_fail_only_their_row():
+    long_recipe = 'r' * (recipe_import.MAX_CSV_FIELD_SIZE + 1)
+    records, report = _parse(f'name,description,recipe,categories\nlong,d,{long_recipe},1\nok,d,r,2;3\n', 'csv')
+    assert [record[1:] for record in records] == [('ok', 'd', 'r', '', [2, 3])]
+    assert [line for line, _ in report.errors] == [2]
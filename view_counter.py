@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import logging
+from collections import Counter
+
+import dao
+from settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Write-behind buffer for recipe views.
+
+    Views are counted in memory per recipe id and written to the database
+    periodically as one batched `popularity = popularity + n` UPDATE.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._pending: Counter[int] = Counter()
+        self._task: asyncio.Task | None = None
+
+    def record(self, recipe_id: int):
+        self._pending[recipe_id] += 1
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        try:
+            await dao.increase_recipes_popularity(dict(pending))
+        except asyncio.CancelledError:
+            self._pending.update(pending)
+            raise
+        except Exception:
+            # keep the views for the next flush instead of losing them
+            self._pending.update(pending)
+            logger.exception('Could not flush %d recipe view counters', len(pending))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+
+view_counter = ViewCounter(Settings.POPULARITY_FLUSH_SECONDS)